@@ -2,3 +2,13 @@ project_code = "reports"
 project_log = "reporting.log"
 graph_width = 1600
 graph_height = 900
+timezone = "Europe/London"
+workers = 4
+timeline_events = 20000
+sunburst_leaves = 20
+exclude_partitions = ["rc"]
+node_ttl = 3600
+output_gzip = True
+result_cache_size = 500
+instrument = False
+prometheus_textfile = ""
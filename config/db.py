@@ -0,0 +1,11 @@
+hostname = ""
+port = ""
+database = ""
+clusters = ["devcluster"]
+username = ""
+password = ""
+use_db_server = False
+aggregate_on_server = False
+chunk_size = 100000
+pool_size = 4
+lookback = 86400
@@ -1,6 +1,11 @@
 hostname = ""
 port = ""
 database = ""
+clusters = ["devcluster"]
 username = ""
 password = ""
-use_db_server = True
\ No newline at end of file
+use_db_server = True
+aggregate_on_server = False
+chunk_size = 100000
+pool_size = 4
+lookback = 86400
@@ -0,0 +1,169 @@
+import argparse
+import datetime
+import os
+import sys
+import zoneinfo
+from config import db
+from config import cfg
+from reports import catalog, scoping
+
+
+# Read a size such as 10k, 2.5M or 20000
+def size(text):
+    multiplier = {'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9}.get(text[-1:].lower(), 1)
+    number = text[:-1] if multiplier > 1 else text
+    return int(float(number) * multiplier)
+
+
+# Read a date such as 2024-05-01 or 2024-05-01T12:00 in the reporting timezone, or a
+# number of days such as 30d for the start of the day that many days ago, as an epoch
+def date(text):
+    timezone = zoneinfo.ZoneInfo(cfg.timezone)
+    if text[-1:].lower() == 'd':
+        day = datetime.datetime.now(timezone).date() - datetime.timedelta(days=int(text[:-1]))
+        moment = datetime.datetime.combine(day, datetime.time(), timezone)
+    else:
+        moment = datetime.datetime.fromisoformat(text).replace(tzinfo=timezone)
+
+    return int(moment.timestamp())
+
+
+# Print the reports and the tables they read
+def list_reports(names):
+    for name in names:
+        declared = catalog.declarations(name)
+        print('{:<24} {}'.format(name, ', '.join(declared['tables']) or '-'))
+
+
+# Print what a run would do without fetching any data or importing the libraries
+# the reports need. The plan adds the columns and filters of each view.
+def describe(names, clusters, scope, plan=False):
+    requirements = []
+    for cluster in clusters:
+        for name in names:
+            declared = catalog.declarations(name)
+            missing = scoping.unsupported(declared['tables'], scope)
+            if len(missing) > 0:
+                print('{} -> skipped, {}'.format('/'.join(filter(None, [cluster, name])),
+                                                 ', '.join('the {} table has no {}'.format(table, filter_name)
+                                                           for table, filter_name in missing)))
+                continue
+
+            required = catalog.requires(declared['tables'], declared['server_aggregation'], cluster)
+            requirements.append(required)
+
+            print('{} -> {}'.format('/'.join(filter(None, [cluster, name])),
+                                    os.path.join('output', cluster or '', catalog.label(scope), 'samples',
+                                                 name + '.html')))
+            if len(required) == 0:
+                print('    aggregated on the database server')
+            for table, columns in required.items():
+                if plan:
+                    print('    {}: {}'.format(table, ', '.join(columns)))
+                    if table in declared['filters']:
+                        print('        where {}'.format(declared['filters'][table]))
+                else:
+                    print('    {}'.format(table))
+
+    if len(scope) > 0:
+        print('scope: {}'.format(catalog.label(scope)))
+    print('source: {}'.format('database {} on {}'.format(db.database, db.hostname) if db.use_db_server
+                              else 'cache only'))
+    # The derived tables are calculated from others rather than fetched
+    for table, columns in catalog.combine(requirements).items():
+        action = 'fetch {}'.format(table)
+        if table in catalog.derived:
+            action = 'derive {} from {}'.format(table, ', '.join(catalog.derived[table]) or 'sinfo')
+        print('{}: {}'.format(action, ', '.join(columns) if plan else '{} columns'.format(len(columns))))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m reports', description='Generate the Slurm reports')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='fetch the data once and run the reports')
+    run_parser.add_argument('reports', nargs='*', help='names of the reports to run')
+    run_parser.add_argument('--all', action='store_true', help='run every report')
+    run_parser.add_argument('--workers', type=int, default=cfg.workers,
+                            help='number of reports to render in parallel (default: %(default)s)')
+    run_parser.add_argument('--cluster', action='append', dest='clusters', metavar='CLUSTER',
+                            help='write the reports for this cluster alone, can be repeated '
+                                 '(default: every cluster combined)')
+    run_parser.add_argument('--each-cluster', action='store_true',
+                            help='write the reports for every cluster combined and for each cluster')
+    run_parser.add_argument('--since', type=date,
+                            help='only the jobs and events from this date, e.g. 2024-05-01 or 30d for the last '
+                                 '30 days, and the days from it (default: the full history)')
+    run_parser.add_argument('--until', type=date, help='only the jobs, events and days before this date')
+    run_parser.add_argument('--partition', action='append', metavar='PARTITION',
+                            help='only this partition, can be repeated')
+    run_parser.add_argument('--account', action='append', metavar='ACCOUNT', help='only this account, can be repeated')
+    run_parser.add_argument('--user', action='append', metavar='USER', help='only this user, can be repeated')
+    run_parser.add_argument('--list', action='store_true', help='list the reports and the tables they read')
+    run_parser.add_argument('--dry-run', action='store_true',
+                            help='show the reports, output files and tables a run would use without running it')
+    run_parser.add_argument('--plan', action='store_true',
+                            help='like --dry-run, also showing the columns and filters of each table')
+
+    benchmark_parser = commands.add_parser('benchmark', help='time the reports against a synthetic dataset')
+    benchmark_parser.add_argument('reports', nargs='*', help='names of the reports to time (default: all)')
+    benchmark_parser.add_argument('--jobs', type=size, default='100k',
+                                  help='number of jobs to generate, e.g. 10k or 100M (default: 100k)')
+    benchmark_parser.add_argument('--nodes', type=size, default='1k',
+                                  help='number of nodes to generate (default: 1k)')
+    benchmark_parser.add_argument('--months', type=int, default=12,
+                                  help='number of months to spread the jobs over (default: %(default)s)')
+    benchmark_parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    benchmark_parser.add_argument('--reuse', action='store_true',
+                                  help='reuse the last dataset if it was generated with the same parameters')
+    benchmark_parser.add_argument('--output', help='file to write the results to as JSON')
+
+    args = parser.parse_args()
+
+    # Only the declarations of the reports are read until they're run, so listing
+    # and planning don't import pandas, plotly or the database connector
+    available = catalog.discover()
+    listing = args.command == 'run' and args.list
+    if args.command == 'benchmark' or listing:
+        names = args.reports or available
+    else:
+        names = available if args.all else args.reports
+
+    unknown = [name for name in names if name not in available]
+    if len(unknown) > 0:
+        parser.error('unknown reports: {}'.format(', '.join(unknown)))
+
+    if listing:
+        list_reports(names)
+        return
+    if len(names) == 0:
+        parser.error('give the reports to run or --all')
+
+    if args.command == 'benchmark':
+        from reports import benchmark
+        sys.exit(benchmark.run(names, args.jobs, args.nodes, args.months, seed=args.seed,
+                               reuse=args.reuse, output_file=args.output))
+
+    clusters = args.clusters or [None]
+    if args.each_cluster:
+        clusters = [None] + db.clusters
+    unknown = [cluster for cluster in clusters if cluster is not None and cluster not in db.clusters]
+    if len(unknown) > 0:
+        parser.error('unknown clusters: {}'.format(', '.join(unknown)))
+
+    # The reports for a scope are written to a directory of their own
+    scope = {name: getattr(args, name) for name in ['since', 'until', 'partition', 'account', 'user']
+             if getattr(args, name) is not None}
+    if 'since' in scope and 'until' in scope and scope['since'] >= scope['until']:
+        parser.error('--since must be before --until')
+
+    if args.dry_run or args.plan:
+        describe(names, clusters, scope, plan=args.plan)
+        return
+
+    from reports import runner
+    sys.exit(runner.run(names, workers=args.workers, clusters=clusters, scope=scope))
+
+
+if __name__ == '__main__':
+    main()
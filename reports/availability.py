@@ -0,0 +1,152 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import cfg
+from reports import log, cache, catalog, results, timeline, instrument
+
+
+# A node is down while it has any event, so the overlapping events of each node are
+# unioned into outages before anything is counted. Each outage which starts in the
+# window is one failure, and the mean time between failures is the time up divided
+# by the failures. These are the tables of results for each window.
+summaries = ['node', 'partition', 'reason']
+
+
+# Add the events which are still open, e.g. a node which has been down since the
+# start of the month, to the ended ones as though they end when they were fetched
+def with_open(events_df, open_df):
+    if len(open_df) == 0:
+        return events_df
+
+    open_df = open_df.assign(time_end=open_df['time_fetched']).drop(columns='time_fetched')
+    return pd.concat([events_df, open_df], ignore_index=True)
+
+
+# Clip the events to the window [since, until), dropping those outside it
+def clip(events_df, since, until):
+    events_df = events_df[(events_df['time_start'] < until) & (events_df['time_end'] > since)]
+    return events_df.assign(time_start=events_df['time_start'].clip(lower=since),
+                            time_end=events_df['time_end'].clip(upper=until))
+
+
+# Union the overlapping events of each group within the window with a single sort,
+# giving the seconds each outage lasted and whether it began in the window rather
+# than carrying on from before it
+@instrument.timed
+def outages(events_df, by, since, until):
+    merged_df = timeline.merge(clip(events_df[by + ['time_start', 'time_end']], since, until), by)
+    return merged_df.assign(seconds=merged_df['time_end'] - merged_df['time_start'],
+                            failures=(merged_df['time_start'] > since).astype(int))
+
+
+# Add the availability (%), mean time between failures and mean time to repair
+# (hours) to totals of downtime and failures over the node-hours in the window
+def rates(df, hours):
+    hours = pd.Series(hours, index=df.index)
+    up = hours - df['downtime']
+    failures = df['failures'].where(df['failures'] > 0)
+    return df.assign(availability=(100 * up / hours).where(hours > 0),
+                     mtbf=up / failures,
+                     mttr=df['downtime'] / failures)
+
+
+# Calculate the downtime and availability of every node, partition and event reason
+# in the window [since, until). Nodes are taken from the inventory, along with any
+# which had events but aren't in it, so nodes which were never down count as up.
+def summarise(events_df, nodes_df, since, until):
+    key = ['cluster', 'node_name']
+    window = (until - since) / 3600
+    events_df = events_df.astype({'cluster': str, 'node_name': str, 'reason': str})
+    nodes_df = nodes_df[key + ['partitions']].astype(str)
+
+    down_df = outages(events_df, key, since, until).groupby(key).agg(downtime=('seconds', 'sum'),
+                                                                       failures=('failures', 'sum'))
+    node_df = nodes_df.merge(down_df.reset_index(), on=key, how='outer')
+    node_df = node_df.fillna({'partitions': '', 'downtime': 0, 'failures': 0})
+    node_df = node_df.astype({'downtime': float, 'failures': int})
+    node_df['downtime'] /= 3600
+    node_df = rates(node_df, window)
+
+    # A node counts towards every partition it belongs to
+    partition_df = node_df.assign(partition=node_df['partitions'].str.split(',')).explode('partition')
+    partition_df = partition_df.groupby(['cluster', 'partition']).agg(nodes=('node_name', 'size'),
+                                                                     downtime=('downtime', 'sum'),
+                                                                     failures=('failures', 'sum')).reset_index()
+    partition_df = rates(partition_df, partition_df['nodes'] * window)
+
+    # The events of one reason are unioned on each node, but different reasons can
+    # overlap, so the reasons can add up to more than the downtime of the nodes
+    reason_df = outages(events_df, key + ['reason'], since, until)
+    reason_df = reason_df.groupby(['cluster', 'reason']).agg(nodes=('node_name', 'nunique'),
+                                                             events=('events', 'sum'),
+                                                             downtime=('seconds', 'sum')).reset_index()
+    reason_df['downtime'] /= 3600
+    reason_df = reason_df.sort_values('downtime', ascending=False, ignore_index=True)
+
+    return {'node': node_df, 'partition': partition_df, 'reason': reason_df}
+
+
+# The files the results of a window are kept in. A scope of partitions narrows the
+# nodes and events, so it's part of the name, but since and until only cut the
+# window short, which its bounds already give.
+def window_files(since, until, cluster=None, scope=None):
+    path = cache.table_path('availability')
+    narrowed = catalog.label({name: value for name, value in (scope or {}).items() if name not in ['since', 'until']})
+    prefix = '_'.join(filter(None, [cluster or 'all', narrowed]))
+    return {table: os.path.join(path, '{}-{}-{}-{}.parquet'.format(prefix, since, until, table))
+            for table in summaries}
+
+
+# Hash the rows a window is calculated from: the events which overlap it and the
+# nodes, along with the code. The cached files are rewritten by every sync, e.g. the
+# rows fetched again from db.lookback before the mark, so their contents are hashed
+# rather than their times compared.
+def window_key(events_df, nodes_df, since, until):
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update('{}-{}-{}'.format(since, until, results.source_digest()).encode())
+    for df in [clip(events_df, since, until), nodes_df]:
+        hasher.update(','.join(df.columns).encode())
+        hasher.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+
+    return hasher.hexdigest().encode()
+
+
+# Summarise the window [since, until) of the event and node tables of a cluster, or
+# every cluster, given as frames read for the scope. The results are kept in the
+# cache with the key of the rows they were calculated from, and read back while the
+# key is the same, so only the windows with changed events, e.g. the current month,
+# are calculated again.
+@instrument.timed
+def window(events_df, nodes_df, since, until, cluster=None, scope=None):
+    since, until = int(since), int(until)
+    file_paths = window_files(since, until, cluster, scope)
+    key = window_key(events_df, nodes_df, since, until)
+    if all(os.path.exists(file_path) and (pq.read_schema(file_path).metadata or {}).get(b'window') == key
+           for file_path in file_paths.values()):
+        return {table: pd.read_parquet(file_path) for table, file_path in file_paths.items()}
+
+    summary = summarise(events_df, nodes_df, since, until)
+    os.makedirs(cache.table_path('availability'), exist_ok=True)
+    for table, file_path in file_paths.items():
+        arrow_table = pa.Table.from_pandas(summary[table], preserve_index=False)
+        arrow_table = arrow_table.replace_schema_metadata({**arrow_table.schema.metadata, b'window': key})
+        temp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+        pq.write_table(arrow_table, temp_path)
+        os.replace(temp_path, file_path)
+
+    log.logger.debug('Calculated the availability of {} nodes from {} to {}'
+                     .format(len(summary['node']), cache.month(since), cache.month(until)))
+    return summary
+
+
+# The windows of each calendar month in the reporting timezone covering [since, until),
+# as pairs of epochs. The first and last are cut short at since and until.
+def months(since, until):
+    first = pd.Timestamp(since, unit='s', tz='UTC').tz_convert(cfg.timezone)
+    first = first.tz_localize(None).to_period('M').start_time.tz_localize(cfg.timezone)
+    starts = pd.date_range(first, pd.Timestamp(until, unit='s', tz='UTC').tz_convert(cfg.timezone), freq='MS')
+    edges = np.append(np.maximum(starts.asi8 // 10 ** 9, since), until)
+    return [(int(start), int(end)) for start, end in zip(edges[:-1], edges[1:]) if end > start]
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from reports import instrument
+
+
+# Build a sorted interval index of the time each job spent pending in each group.
+# A job is pending from time_submit until it starts, or until it ends if it never
+# started, which for a job still in the queue is when it was fetched. The submit and
+# leave times are sorted separately, so the number pending at any time is the
+# difference of two binary searches, and the waits are kept in start order for
+# windows over the jobs which started.
+@instrument.timed
+def index(jobs_df, by='partition'):
+    jobs_df = jobs_df[jobs_df['time_submit'] > 0]
+    started = jobs_df['time_start'] != 0
+    leave = jobs_df['time_start'].where(started, jobs_df['time_end'])
+
+    groups = {}
+    for group, group_df in jobs_df.assign(leave=leave, started=started).groupby(by, observed=True, sort=True):
+        started_df = group_df[group_df['started']].sort_values('time_start')
+        groups[group] = {'submit': np.sort(group_df['time_submit'].to_numpy()),
+                         'leave': np.sort(group_df['leave'].to_numpy()),
+                         'start': started_df['time_start'].to_numpy(),
+                         'wait': (started_df['time_start'] - started_df['time_submit']).clip(lower=0).to_numpy()}
+
+    return groups
+
+
+# The number of jobs pending in each group at each of the times (epochs)
+def depth(groups, times, by='partition'):
+    times = np.asarray(times)
+    tables = []
+    for group, intervals in groups.items():
+        submitted = np.searchsorted(intervals['submit'], times, side='right')
+        left = np.searchsorted(intervals['leave'], times, side='right')
+        tables.append(pd.DataFrame({by: group, 'time': times, 'pending': submitted - left}))
+
+    if len(tables) == 0:
+        return pd.DataFrame(columns=[by, 'time', 'pending'])
+
+    return pd.concat(tables, ignore_index=True)
+
+
+# Percentiles (0-100) of the waits, in seconds, of the jobs in each group which
+# started in the window seconds before each of the times, along with the number of
+# jobs. Each window is a slice of the start ordered waits, so only the jobs in the
+# windows are visited rather than every job for every time.
+def waits(groups, times, window, points=(50, 95), by='partition'):
+    times = np.asarray(times)
+    tables = []
+    for group, intervals in groups.items():
+        lows = np.searchsorted(intervals['start'], times - window, side='left')
+        highs = np.searchsorted(intervals['start'], times, side='left')
+
+        table = {by: group, 'time': times, 'jobs': highs - lows}
+        values = np.full((len(times), len(points)), np.nan)
+        for row, (low, high) in enumerate(zip(lows, highs)):
+            if high > low:
+                values[row] = np.percentile(intervals['wait'][low:high], points)
+        for column, point in enumerate(points):
+            table['p{:d}'.format(point)] = values[:, column]
+        tables.append(pd.DataFrame(table))
+
+    if len(tables) == 0:
+        return pd.DataFrame(columns=[by, 'time', 'jobs'] + ['p{:d}'.format(point) for point in points])
+
+    return pd.concat(tables, ignore_index=True)
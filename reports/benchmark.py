@@ -0,0 +1,286 @@
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+from config import db
+from config import cfg
+from reports import log, cache, extract, output, runner, instrument
+
+
+# Determine the root of the project location
+script_path = os.path.realpath(__file__)
+project_path, report_path = script_path.split(cfg.project_code)
+benchmark_path = os.path.join(project_path, 'scratch', 'benchmark')
+results_path = os.path.join(project_path, 'output', 'benchmark')
+
+# The synthetic cluster. The compute nodes are shared by the CPU partitions, with the
+# share of the jobs submitted to each partition, and each node group has the CPUs,
+# memory (MB) and GPUs of its nodes and its share of the nodes.
+partitions = {'short': 0.35, 'medium': 0.3, 'long': 0.15, 'gpu': 0.12, 'hmem': 0.08}
+node_groups = {'node': {'partitions': ['short', 'medium', 'long'], 'cpus': 64, 'memory': 256000,
+                        'gres': '', 'gpus': 0, 'share': 0.85},
+               'gpu': {'partitions': ['gpu'], 'cpus': 48, 'memory': 384000,
+                       'gres': 'gpu:a100:4', 'gpus': 4, 'share': 0.1},
+               'hmem': {'partitions': ['hmem'], 'cpus': 96, 'memory': 1536000,
+                        'gres': '', 'gpus': 0, 'share': 0.05}}
+
+# The Slurm job states and how often jobs which started end in them
+# (COMPLETED, FAILED, CANCELLED, TIMEOUT, NODE_FAIL)
+states = {3: 0.72, 5: 0.12, 4: 0.08, 6: 0.06, 7: 0.02}
+timelimits = [60, 240, 1440, 4320, 10080]
+reasons = ['Not responding', 'Kill task failed', 'Maintenance', 'Hardware error', 'Reboot ASAP']
+
+
+# Generate the nodes of each group, named like node00001, and their sinfo inventory
+def generate_nodes(nodes, width):
+    groups = {}
+    inventory = []
+    for prefix, group in node_groups.items():
+        count = max(1, int(nodes * group['share']))
+        groups[prefix] = count
+        inventory.append(pd.DataFrame({'node_name': ['{}{:0{}d}'.format(prefix, index, width)
+                                                     for index in range(count)],
+                                       'partitions': ','.join(group['partitions']),
+                                       'cpus': group['cpus'],
+                                       'memory': group['memory'],
+                                       'gres': group['gres'],
+                                       'gpus': group['gpus']}))
+
+    return groups, pd.concat(inventory, ignore_index=True)
+
+
+# Generate the users, whose activity follows a Zipf like distribution, in groups of
+# up to 8 per account
+def generate_assoc(users, mod_time):
+    ids = np.arange(1, users + 1)
+    return pd.DataFrame({'id_assoc': ids,
+                         'user': ['user{:05d}'.format(index) for index in ids],
+                         'acct': ['acc{:04d}'.format(index // 8) for index in ids],
+                         'partition': '',
+                         'deleted': 0,
+                         'mod_time': mod_time})
+
+
+# Generate the jobs which ended in [since, until) with the columns of the job table
+def generate_jobs(rng, count, since, until, first, groups, width, assoc_df):
+    names = list(partitions)
+    partition = rng.choice(names, count, p=list(partitions.values()))
+    prefix = np.select([partition == 'gpu', partition == 'hmem'], ['gpu', 'hmem'], 'node')
+
+    # Most jobs are small, with some multi-node jobs on the compute nodes
+    nodes_alloc = np.where((prefix == 'node') & (rng.random(count) < 0.15),
+                           rng.geometric(0.4, count) + 1, 1)
+    group_count = pd.Series(prefix).map(groups).to_numpy()
+    nodes_alloc = np.minimum(nodes_alloc, group_count)
+    cpus_req = rng.choice([1, 2, 4, 8, 16, 32, 64], count, p=[0.3, 0.15, 0.15, 0.15, 0.1, 0.1, 0.05]) * nodes_alloc
+    mem_req = cpus_req * rng.choice([2000, 4000, 8000], count)
+    gpus = np.where(partition == 'gpu', rng.choice([0, 1, 2, 4], count, p=[0.05, 0.6, 0.2, 0.15]), 0)
+
+    # Elapsed and wait times have long tails, and some jobs never start
+    timelimit = rng.choice(timelimits, count, p=[0.3, 0.3, 0.25, 0.1, 0.05])
+    started = rng.random(count) >= 0.03
+    state = np.where(started, rng.choice(list(states), count, p=list(states.values())), 4)
+    elapsed = np.clip(rng.lognormal(np.log(1800), 1.6, count), 1, timelimit * 60).astype(np.int64)
+    elapsed = np.where(state == 6, timelimit * 60, elapsed)
+    wait = np.clip(rng.lognormal(np.log(120), 2.0, count), 0, 30 * 86400).astype(np.int64)
+
+    time_end = np.sort(rng.integers(since, until, count))
+    time_start = np.where(started, time_end - elapsed, 0)
+    time_submit = np.where(started, time_start, time_end) - wait
+
+    # The nodes are a contiguous range of the node group
+    first_node = pd.Series((rng.random(count) * (group_count - nodes_alloc + 1)).astype(np.int64))
+    last_node = first_node + nodes_alloc - 1
+    single = pd.Series(prefix) + first_node.astype(str).str.zfill(width)
+    multiple = (pd.Series(prefix) + '[' + first_node.astype(str).str.zfill(width)
+                + '-' + last_node.astype(str).str.zfill(width) + ']')
+    nodelist = np.where(~started, 'None assigned', np.where(nodes_alloc > 1, multiple, single))
+
+    tres = ('1=' + pd.Series(cpus_req).astype(str) + ',2=' + pd.Series(mem_req).astype(str)
+            + ',4=' + pd.Series(nodes_alloc).astype(str)
+            + np.where(gpus > 0, ',1001=' + pd.Series(gpus).astype(str), ''))
+
+    users = len(assoc_df)
+    weights = 1 / np.arange(1, users + 1) ** 1.1
+    id_assoc = rng.choice(assoc_df['id_assoc'].to_numpy(), count, p=weights / weights.sum())
+    account = pd.Series(id_assoc).map(assoc_df.set_index('id_assoc')['acct'])
+
+    return pd.DataFrame({'job_db_inx': np.arange(first, first + count),
+                         'id_job': np.arange(first, first + count) + 1000,
+                         'id_assoc': id_assoc,
+                         'id_user': id_assoc + 1000,
+                         'account': account,
+                         'partition': partition,
+                         'state': state,
+                         'exit_code': np.where(state == 5, 256, 0),
+                         'cpus_req': cpus_req,
+                         'mem_req': mem_req,
+                         'nodes_alloc': np.where(started, nodes_alloc, 0),
+                         'nodelist': nodelist,
+                         'timelimit': timelimit,
+                         'time_submit': time_submit,
+                         'time_eligible': time_submit,
+                         'time_start': time_start,
+                         'time_end': time_end,
+                         'tres_req': tres,
+                         'tres_alloc': np.where(started, tres, '')})
+
+
+# Generate the batch step of each job which started, using a share of the CPU time
+# and memory of the job with most jobs using little of what they were given. The peak
+# memory is in bytes as in slurmdbd.
+def generate_steps(rng, jobs_df):
+    jobs_df = jobs_df[jobs_df['time_start'] != 0]
+    count = len(jobs_df)
+    elapsed = (jobs_df['time_end'] - jobs_df['time_start']).to_numpy()
+    cpu_time = elapsed * jobs_df['cpus_req'].to_numpy() * rng.beta(2, 3, count)
+    max_rss = jobs_df['mem_req'].to_numpy() / jobs_df['nodes_alloc'].to_numpy() * rng.beta(2, 5, count) * 2 ** 20
+    user_sec = (cpu_time * 0.95).astype(np.int64)
+    sys_sec = (cpu_time * 0.05).astype(np.int64)
+
+    return pd.DataFrame({'job_db_inx': jobs_df['job_db_inx'].to_numpy(),
+                         'id_step': -5,
+                         'step_het_comp': 4294967294,
+                         'time_start': jobs_df['time_start'].to_numpy(),
+                         'time_end': jobs_df['time_end'].to_numpy(),
+                         'user_sec': user_sec,
+                         'user_usec': rng.integers(0, 10 ** 6, count),
+                         'sys_sec': sys_sec,
+                         'sys_usec': rng.integers(0, 10 ** 6, count),
+                         'tres_usage_in_max': '1=' + pd.Series(cpu_time.astype(np.int64)).astype(str)
+                                              + ',2=' + pd.Series(max_rss.astype(np.int64)).astype(str)})
+
+
+# Generate the node events which started in [since, until), about one per
+# three nodes, lasting from minutes to days
+def generate_events(rng, since, until, inventory_df):
+    count = rng.poisson(len(inventory_df) * 0.3)
+    time_start = rng.integers(since, until, count)
+    return pd.DataFrame({'node_name': rng.choice(inventory_df['node_name'].to_numpy(), count),
+                         'reason': rng.choice(reasons, count),
+                         'state': 1,
+                         'time_start': time_start,
+                         'time_end': time_start + rng.lognormal(np.log(3600), 1.5, count).astype(np.int64) + 1})
+
+
+# Fill the cache with a synthetic slurmdbd dataset of the given size, spread evenly
+# over the months before until, for the first configured cluster. Each month is
+# generated and written on its own so the memory needed depends on the jobs per
+# month rather than the total.
+def generate(jobs, nodes, months, users=None, seed=0, until=None):
+    rng = np.random.default_rng(seed)
+    until = pd.Timestamp(until or pd.Timestamp.now()).normalize().replace(day=1)
+    bounds = [int(month.timestamp()) for month in pd.date_range(end=until, periods=months + 1, freq='MS')]
+
+    shutil.rmtree(cache.cache_path, ignore_errors=True)
+    cache.upgrade()
+    cluster = db.clusters[0]
+
+    width = max(5, len(str(nodes)))
+    groups, inventory_df = generate_nodes(nodes, width)
+    cache.write('node', inventory_df.assign(cluster=cluster))
+
+    assoc_df = generate_assoc(users or min(max(jobs // 1000, 20), 20000), bounds[0])
+    cache.merge('assoc', cache.typed(assoc_df.assign(cluster=cluster)), extract.tables['assoc']['key'])
+
+    first = 1
+    for month, (since, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        count = jobs // months + (1 if month < jobs % months else 0)
+        jobs_df = generate_jobs(rng, count, since, end, first, groups, width, assoc_df)
+        cache.merge('job', cache.typed(jobs_df.assign(cluster=cluster)), extract.tables['job']['key'])
+        steps_df = generate_steps(rng, jobs_df)
+        cache.merge('step', cache.typed(steps_df.assign(cluster=cluster)), extract.tables['step']['key'])
+        events_df = generate_events(rng, since, end, inventory_df)
+        cache.merge('event', cache.typed(events_df.assign(cluster=cluster)), extract.tables['event']['key'])
+        first += count
+
+    log.logger.info('Generated {} jobs on {} nodes over {} months'.format(jobs, len(inventory_df), months))
+
+
+# Time the fastest of several starts of the command line interface which don't run a
+# report, i.e. the cost of its imports, to catch a heavy import creeping back in
+def startup_time(repeat=5):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'reports', 'run', '--list'], check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+
+    return min(times)
+
+
+# Generate a dataset, or reuse the last one if it has the same parameters, then time
+# each stage of the reports against it: reading the cache in place of fetching from
+# the database, the shared rollups, building the figure, rendering it and writing it
+def run(names, jobs, nodes, months, seed=0, reuse=False, output_file=None):
+    # Keep the benchmark apart from the real cache, database and node inventory, and
+    # keep the instrumentation records here rather than in the metrics file
+    cache.cache_path = os.path.join(benchmark_path, 'cache')
+    db.use_db_server = False
+    cfg.node_ttl = math.inf
+    instrument.enabled = True
+    instrument.metrics_path = None
+    instrument.collect()
+    output_path = os.path.join(benchmark_path, 'output')
+    os.makedirs(output_path, exist_ok=True)
+
+    parameters = {'jobs': jobs, 'nodes': nodes, 'months': months, 'seed': seed}
+    parameters_file = os.path.join(benchmark_path, 'parameters.json')
+
+    started = time.perf_counter()
+    previous = None
+    if reuse and os.path.exists(parameters_file):
+        with open(parameters_file) as file:
+            previous = json.load(file)
+    if previous != parameters:
+        with instrument.stage('generate'):
+            generate(jobs, nodes, months, seed=seed)
+        with open(parameters_file, 'w') as file:
+            json.dump(parameters, file)
+
+    reports = [runner.load_report(name) for name in names]
+    with instrument.stage('aggregate'):
+        extract.update(runner.combine(reports))
+
+    plotlyjs_name = output.write_plotlyjs(output_path)
+    failed = []
+    for name, item in zip(names, reports):
+        try:
+            with instrument.stage('fetch', report=name):
+                frames = extract.read(item.requires())
+            with instrument.stage('transform', report=name):
+                fig = item.build(item.load(frames))
+            with instrument.stage('render', report=name):
+                html = output.render(fig, plotlyjs_name, item.script)
+            with instrument.stage('write', report=name):
+                output.write_file(os.path.join(output_path, '.'.join([item.name, 'html'])), html)
+                if item.detail is not None:
+                    output.write_detail(output_path, item.name, item.detail)
+        except Exception:
+            log.logger.exception('Failed {}'.format(name))
+            failed.append(name)
+
+    summary = {'parameters': parameters,
+               'timestamp': pd.Timestamp.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'pandas': pd.__version__,
+               'wall_time': round(time.perf_counter() - started, 3),
+               'startup_time': round(startup_time(), 3),
+               'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+               'failed': failed,
+               'stages': instrument.collect()}
+
+    output_file = output_file or os.path.join(results_path, 'benchmark-{}.json'.format(jobs))
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, 'w') as file:
+        json.dump(summary, file, indent=2)
+    log.logger.info('Benchmarked {} jobs in {:.1f}s, results in {}'.format(jobs, summary['wall_time'], output_file))
+
+    return 1 if failed else 0
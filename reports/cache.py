@@ -0,0 +1,263 @@
+import os
+import shutil
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import cfg
+from reports import log
+
+
+# Determine the root of the project location
+script_path = os.path.realpath(__file__)
+project_path, report_path = script_path.split(cfg.project_code)
+cache_path = os.path.join(project_path, 'scratch', 'cache')
+
+# Tables are split into one Parquet file per month of this column, tables
+# without an entry are kept in a single file
+time_columns = {'job': 'time_end',
+                'event': 'time_end',
+                'step': 'time_end',
+                'rollup': 'day',
+                'rollup_sketch': 'day',
+                'usage': 'day',
+                'efficiency': 'time_end'}
+
+# Repetitive text columns are stored as categories and small counts as the
+# smallest unsigned integer type that fits. Epochs stay as int64 so differences
+# between them can go negative.
+categories = ['cluster', 'partition', 'account', 'acct', 'user', 'node_name', 'reason', 'metric']
+counts = ['state', 'exit_code', 'cpus_req', 'nodes_alloc', 'timelimit', 'deleted']
+
+
+# The layout of the cached tables, which is changed when a cache written by an
+# older version can't be read or merged into
+version = 2
+
+
+# Clear the cache if it was written with an older layout, returning True if it was
+def upgrade():
+    version_file = os.path.join(cache_path, 'version')
+    cached = None
+    if os.path.exists(version_file):
+        with open(version_file) as file:
+            cached = int(file.read().strip() or 0)
+
+    if cached == version:
+        return False
+
+    cleared = os.path.isdir(cache_path) and len(os.listdir(cache_path)) > 0
+    if cleared:
+        log.logger.warning('Clearing the cache written with layout {} to rebuild it with layout {}'
+                           .format(cached or 1, version))
+        shutil.rmtree(cache_path)
+
+    os.makedirs(cache_path, exist_ok=True)
+    with open(version_file, 'w') as file:
+        file.write('{}\n'.format(version))
+    return cleared
+
+
+def table_path(table):
+    return os.path.join(cache_path, table)
+
+
+def exists(table):
+    path = table_path(table)
+    return os.path.isdir(path) and len(os.listdir(path)) > 0
+
+
+# The number of seconds since a table was last written, or None if it isn't cached
+def age(table):
+    file_paths = files(table)
+    if len(file_paths) == 0:
+        return None
+
+    return time.time() - max(os.path.getmtime(file_path) for file_path in file_paths)
+
+
+def month(epoch):
+    return pd.to_datetime(epoch, unit='s').strftime('%Y-%m')
+
+
+# List the partition files of a table, skipping the months outside [since, until)
+def files(table, since=None, until=None):
+    if not exists(table):
+        return []
+
+    path = table_path(table)
+    names = sorted(name for name in os.listdir(path) if name.endswith('.parquet'))
+
+    if table in time_columns:
+        if since is not None:
+            names = [name for name in names if name[:7] >= month(since)]
+        if until is not None:
+            names = [name for name in names if name[:7] <= month(until)]
+
+    return [os.path.join(path, name) for name in names]
+
+
+# Convert a frame to the compact types used in the cache
+def typed(df):
+    columns = {}
+    for column in df.columns.intersection(categories):
+        columns[column] = df[column].astype('category')
+    for column in df.columns.intersection(counts):
+        columns[column] = pd.to_numeric(df[column], downcast='unsigned')
+
+    return df.assign(**columns)
+
+
+# One lock per table, as the clusters are fetched into the same files at the same time
+locks = {}
+locks_lock = threading.Lock()
+
+
+def lock(table):
+    with locks_lock:
+        return locks.setdefault(table, threading.Lock())
+
+
+# Merge new rows into the cache, replacing any existing rows with the same key
+def merge(table, df, key):
+    with lock(table):
+        merge_unlocked(table, df, key)
+
+
+def merge_unlocked(table, df, key):
+    path = table_path(table)
+    os.makedirs(path, exist_ok=True)
+
+    time_column = time_columns.get(table)
+    if time_column is None:
+        groups = [('all', df)]
+    else:
+        # Group by the month as a number and only format the name of each month
+        months = df[time_column].to_numpy().astype('datetime64[s]').astype('datetime64[M]')
+        groups = ((month.strftime('%Y-%m'), part_df) for month, part_df in df.groupby(months))
+
+    for name, part_df in groups:
+        file_path = os.path.join(path, '.'.join([name, 'parquet']))
+        if os.path.exists(file_path):
+            part_df = pd.concat([pd.read_parquet(file_path), part_df], ignore_index=True)
+            part_df = typed(part_df.drop_duplicates(subset=key, keep='last'))
+
+        # Keep the rows in time order so the row group statistics can skip data on read,
+        # then in key order so merging rows which are already cached rewrites the
+        # file byte for byte
+        order = [time_column] * (time_column is not None) + [column for column in key if column != time_column]
+        part_df = part_df.sort_values(order, ignore_index=True)
+
+        # Write to a temporary file first so an interrupted run can't corrupt the cache
+        temp_path = file_path + '.tmp'
+        part_df.to_parquet(temp_path, index=False)
+        os.replace(temp_path, file_path)
+
+    log.logger.debug('Merged {} rows into the {} cache'.format(len(df), table))
+
+
+# Replace the contents of a table which isn't split by month
+def write(table, df):
+    path = table_path(table)
+    os.makedirs(path, exist_ok=True)
+
+    file_path = os.path.join(path, 'all.parquet')
+    temp_path = file_path + '.tmp'
+    typed(df).to_parquet(temp_path, index=False)
+    os.replace(temp_path, file_path)
+
+
+# Replace the rows of one cluster in a table which isn't split by month, e.g. a
+# snapshot, keeping the rows of the other clusters
+def replace(table, cluster, df):
+    with lock(table):
+        kept_df = read(table)
+        if len(kept_df) > 0:
+            kept_df = kept_df[kept_df['cluster'] != cluster]
+
+        # An empty frame has no types to keep, so it's only written when both are empty
+        frames = [frame for frame in [kept_df, df.assign(cluster=cluster)] if len(frame) > 0]
+        write(table, pd.concat(frames, ignore_index=True) if len(frames) > 0 else df.assign(cluster=cluster))
+
+
+# Small tables joined to others, e.g. assoc for the users, kept in memory until
+# their files change
+dimensions = {}
+
+
+# Join the columns of a dimension table to a frame on the key columns, reading the
+# table from the cache only when it has changed
+def lookup(df, table, key, columns):
+    stamp = tuple((file_path, os.path.getmtime(file_path)) for file_path in files(table))
+    cached = dimensions.get((table, tuple(key), tuple(columns)))
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, read(table, columns=key + columns))
+        dimensions[(table, tuple(key), tuple(columns))] = cached
+
+    return df.merge(cached[1], on=key, how='left')
+
+
+# The newest value of a column of a table for each of the clusters given, or None
+# for the clusters with no rows yet, e.g. one just added to db.clusters. The files
+# are read from the newest back until every cluster has been found.
+def latest(table, column, clusters):
+    marks = {}
+    for file_path in reversed(files(table)):
+        newest = pd.read_parquet(file_path, columns=['cluster', column]).groupby('cluster', observed=True)[column].max()
+        for cluster, value in newest.items():
+            marks.setdefault(str(cluster), int(value))
+        if all(cluster in marks for cluster in clusters):
+            break
+
+    return {cluster: marks.get(cluster) for cluster in clusters}
+
+
+# Read the rows of each cluster with the time column of a table at or after its
+# mark, and every row of the clusters whose mark is None
+def read_since(table, marks, columns=None):
+    time_column = time_columns[table]
+    since = None if None in marks.values() else min(marks.values())
+    filters = [[('cluster', '==', cluster)] + [(time_column, '>=', mark)] * (mark is not None)
+               for cluster, mark in marks.items()]
+    return read(table, columns=columns, since=since, filters=filters)
+
+
+# An empty frame of the columns of a table, with the types they're cached with, or
+# without types when the table hasn't been cached yet
+def empty(table, columns=None):
+    file_paths = files(table)
+    if len(file_paths) == 0:
+        return pd.DataFrame(columns=columns)
+
+    empty_table = pq.read_schema(file_paths[-1]).empty_table()
+    df = (empty_table.select(columns) if columns is not None else empty_table).to_pandas()
+    return df.astype({column: 'category' for column in df.columns.intersection(categories)})
+
+
+# Read a table from the cache, loading only the requested columns and the rows
+# with a time column in [since, until) where since and until are epoch seconds.
+# Further filters can be given as a list of lists of (column, op, value), where the
+# rows matching any of the lists are read, and are used to skip row groups.
+def read(table, columns=None, since=None, until=None, filters=None):
+    if filters is not None and len(filters) == 0:
+        return empty(table, columns)
+
+    bounds = []
+    time_column = time_columns.get(table)
+    if time_column is not None:
+        if since is not None:
+            bounds.append((time_column, '>=', since))
+        if until is not None:
+            bounds.append((time_column, '<', until))
+    filters = [bounds + conjunction for conjunction in filters or [[]]]
+
+    tables = [pq.read_table(file_path, columns=columns, filters=filters if any(filters) else None,
+                            memory_map=True, read_dictionary=categories)
+              for file_path in files(table, since, until)]
+
+    if len(tables) == 0:
+        return empty(table, columns)
+
+    # Months may have been stored with different integer widths
+    return pa.concat_tables(tables, promote_options='permissive').to_pandas()
@@ -0,0 +1,86 @@
+import ast
+import datetime
+import os
+import pkgutil
+import zoneinfo
+from config import db
+from config import cfg
+from reports import samples
+
+
+# The tables calculated from the cache or the cluster rather than fetched from the
+# database, with the tables they're built from, which the node inventory has none of
+derived = {'rollup': ['job', 'assoc'],
+           'rollup_sketch': ['job', 'assoc'],
+           'usage': ['job', 'assoc'],
+           'efficiency': ['job', 'assoc', 'step'],
+           'node': []}
+
+
+# Find every report module in the samples package
+def discover():
+    return sorted(name for _, name, _ in pkgutil.iter_modules(samples.__path__))
+
+
+# Read the declarations of the Report subclass in a report module from its source,
+# without importing it and the libraries it needs
+def declarations(name):
+    with open(os.path.join(samples.__path__[0], name + '.py')) as file:
+        tree = ast.parse(file.read())
+
+    for node in tree.body:
+        bases = [ast.unparse(base) for base in node.bases] if isinstance(node, ast.ClassDef) else []
+        if not any(base.split('.')[-1] == 'Report' for base in bases):
+            continue
+
+        declared = {'class': node.name, 'tables': {}, 'filters': {}, 'server_aggregation': False}
+        for statement in node.body:
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+                target = ast.unparse(statement.targets[0])
+                if target in declared:
+                    declared[target] = ast.literal_eval(statement.value)
+        return declared
+
+    return None
+
+
+# Whether a report which can have the database aggregate its data should, for a
+# cluster or every cluster combined. The server can only aggregate one cluster.
+def aggregate_on_server(server_aggregation, cluster=None):
+    return (server_aggregation and db.use_db_server and db.aggregate_on_server
+            and (cluster is not None or len(db.clusters) == 1))
+
+
+# The cached tables and columns a report reads for a cluster, or every cluster combined
+def requires(tables, server_aggregation, cluster=None):
+    if aggregate_on_server(server_aggregation, cluster):
+        return {}
+    if cluster is None:
+        return tables
+
+    return {table: columns + ['cluster'] * ('cluster' not in columns) for table, columns in tables.items()}
+
+
+# The name of the directory for the output of a scope, e.g. since-2024-05-01_partition-gpu,
+# or '' for the full history
+def label(scope=None):
+    parts = []
+    for name, value in (scope or {}).items():
+        if name in ['since', 'until']:
+            value = datetime.datetime.fromtimestamp(value, zoneinfo.ZoneInfo(cfg.timezone)).strftime('%Y-%m-%d')
+        else:
+            value = '+'.join(value)
+        parts.append('{}-{}'.format(name, value))
+
+    return '_'.join(parts)
+
+
+# Combine the tables and columns the reports read so every table is fetched once
+def combine(requirements):
+    tables = {}
+    for required in requirements:
+        for table, columns in required.items():
+            tables.setdefault(table, [])
+            tables[table] += [column for column in columns if column not in tables[table]]
+
+    return tables
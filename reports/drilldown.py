@@ -0,0 +1,85 @@
+import plotly.graph_objects as go
+from reports import instrument
+
+
+# The label of the leaf holding every leaf of a parent outside its top ones
+other = 'other'
+
+
+# Keep the n leaves of each parent with the largest total value over the rest of the
+# path, and total the others into one leaf labelled other. The values are totalled
+# for each path, so the chart only has as many rows as it draws.
+@instrument.timed
+def top(df, path, value, n):
+    parent, leaf = path[0], path[-1]
+    totals = df.groupby([parent, leaf], observed=True)[value].sum()
+    ranks = totals.groupby(level=0, observed=True).rank(method='first', ascending=False)
+    kept = ranks[ranks <= n].reset_index()[[parent, leaf]].assign(kept=True)
+
+    df = df.astype({parent: str, leaf: str}).merge(kept.astype({parent: str, leaf: str}), how='left')
+    df[leaf] = df[leaf].where(df['kept'].notna(), other)
+    return df.groupby(path, observed=True)[value].sum().reset_index()
+
+
+# A sunburst of the totals of a value along a path of columns. The ids, labels,
+# parents and totals of every level are worked out here, so Plotly doesn't have to
+# regroup the rows and only one value is written per segment.
+def sunburst(df, path, value):
+    ids, labels, parents, values = [], [], [], []
+    for level in range(len(path)):
+        level_df = df.groupby(path[:level + 1], observed=True)[value].sum().reset_index()
+        names = level_df[path[:level + 1]].astype(str)
+        level_ids = names.agg('/'.join, axis=1) if level > 0 else names[path[0]]
+        ids += level_ids.tolist()
+        labels += names[path[level]].tolist()
+        parents += (names[path[:level]].agg('/'.join, axis=1).tolist() if level > 0 else [''] * len(names))
+        values += level_df[value].tolist()
+
+    return go.Sunburst(ids=ids, labels=labels, parents=parents, values=values, branchvalues='total')
+
+
+# Replace an other segment by the leaves it holds when it's clicked, loading the full
+# detail the first time one is. The detail file has the path columns followed by the
+# value, as written by output.write_detail().
+script = '''
+var plot = document.getElementById('{plot_id}');
+var detail = null;
+plot.on('plotly_sunburstclick', function(event) {
+    var point = event.points[0];
+    if (point.label !== '%(other)s') {
+        return true;
+    }
+    var expand = function() {
+        var trace = plot.data[0];
+        var parent = point.parent;
+        var ids = [], labels = [], parents = [], values = [];
+        for (var i = 0; i < trace.ids.length; i++) {
+            if (trace.ids[i] !== point.id) {
+                ids.push(trace.ids[i]); labels.push(trace.labels[i]);
+                parents.push(trace.parents[i]); values.push(trace.values[i]);
+            }
+        }
+        var shown = new Set(ids);
+        detail.data.forEach(function(row) {
+            var id = row.slice(0, -1).join('/');
+            if (row.slice(0, -2).join('/') === parent && !shown.has(id)) {
+                ids.push(id); labels.push(String(row[row.length - 2]));
+                parents.push(parent); values.push(row[row.length - 1]);
+            }
+        });
+        Plotly.restyle(plot, {ids: [ids], labels: [labels], parents: [parents], values: [values]}, [0]);
+    };
+    if (detail === null) {
+        fetch('%(detail)s').then(function(response) { return response.json(); })
+                           .then(function(data) { detail = data; expand(); });
+    } else {
+        expand();
+    }
+    return false;
+});
+'''
+
+
+# The script for a page, which loads its detail from the file next to it
+def expand_script(detail_name):
+    return script % {'other': other, 'detail': detail_name}
@@ -0,0 +1,70 @@
+import numpy as np
+from config import db
+from reports import log, cache, tres
+
+
+# The efficiency table holds one row per finished job with the CPU time its steps
+# used and the peak memory of its largest task, as seff reports them. The CPU
+# efficiency is the CPU time over the time the allocated cores were held, and the
+# memory efficiency the peak memory over the memory requested for each node, both
+# as percentages, or NA for jobs with no step accounting.
+columns = ['cluster', 'job_db_inx', 'account', 'partition', 'user', 'time_end', 'elapsed', 'cpus', 'nodes',
+           'mem_req', 'total_cpu', 'max_rss', 'cpu_efficiency', 'mem_efficiency']
+
+
+# Total the CPU time (seconds) and take the peak memory (MB) of the steps of each job
+def steps(steps_df):
+    total_cpu = (steps_df['user_sec'] + steps_df['sys_sec']
+                 + (steps_df['user_usec'] + steps_df['sys_usec']) / 10 ** 6)
+    max_rss = tres.parse(steps_df['tres_usage_in_max'], ['mem'])['mem'] / 2 ** 20
+    steps_df = steps_df[['cluster', 'job_db_inx']].assign(total_cpu=total_cpu.to_numpy(), max_rss=max_rss.to_numpy())
+    return steps_df.groupby(['cluster', 'job_db_inx'], observed=True).agg(total_cpu=('total_cpu', 'sum'),
+                                                                          max_rss=('max_rss', 'max')).reset_index()
+
+
+# Calculate the efficiency of the jobs of each cluster which ended at or after
+# db.lookback before the last end already calculated, so each run only reads the
+# newly finished jobs, along with those slurmdbd recorded late, and their steps. A
+# cluster without any yet is calculated from the start. A job's steps ended after it
+# started, so only the steps since the earliest start are read.
+def update():
+    marks = {cluster: None if time_end is None else time_end - db.lookback
+             for cluster, time_end in cache.latest('efficiency', 'time_end', db.clusters).items()}
+
+    jobs_df = cache.read_since('job', marks, columns=['cluster', 'job_db_inx', 'id_assoc', 'account', 'partition',
+                                                      'time_start', 'time_end', 'tres_req', 'tres_alloc'])
+    jobs_df = jobs_df[(jobs_df['time_start'] < jobs_df['time_end'])
+                      & (jobs_df['time_start'] != 0)
+                      & (jobs_df['partition'] != '')]
+    if len(jobs_df) == 0:
+        return 0
+
+    # Count what was allocated, or what was requested for jobs without an allocation
+    tres_df = tres.parse(jobs_df['tres_alloc'], ['cpus', 'mem', 'nodes'])
+    missing = tres_df['cpus'] == 0
+    tres_df.loc[missing] = tres.parse(jobs_df.loc[missing, 'tres_req'], ['cpus', 'mem', 'nodes'])
+
+    steps_df = steps(cache.read('step', columns=['cluster', 'job_db_inx', 'user_sec', 'user_usec', 'sys_sec',
+                                                 'sys_usec', 'tres_usage_in_max'],
+                                since=int(jobs_df['time_start'].min())))
+
+    jobs_df = cache.lookup(jobs_df, 'assoc', ['cluster', 'id_assoc'], ['user'])
+    jobs_df = jobs_df.assign(elapsed=jobs_df['time_end'] - jobs_df['time_start'],
+                             cpus=tres_df['cpus'].to_numpy(),
+                             nodes=np.maximum(tres_df['nodes'].to_numpy(), 1),
+                             mem_req=tres_df['mem'].to_numpy())
+    jobs_df = jobs_df.merge(steps_df.astype({'cluster': jobs_df['cluster'].dtype}), how='left',
+                            on=['cluster', 'job_db_inx']).astype({'total_cpu': float, 'max_rss': float})
+
+    core_seconds = (jobs_df['elapsed'] * jobs_df['cpus']).to_numpy(dtype=float)
+    node_memory = (jobs_df['mem_req'] / jobs_df['nodes']).to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cpu_efficiency = np.where(core_seconds > 0, 100 * jobs_df['total_cpu'].to_numpy() / core_seconds, np.nan)
+        mem_efficiency = np.where(node_memory > 0, 100 * jobs_df['max_rss'].to_numpy() / node_memory, np.nan)
+    jobs_df = jobs_df.assign(cpu_efficiency=cpu_efficiency, mem_efficiency=mem_efficiency)
+
+    cache.merge('efficiency', cache.typed(jobs_df[columns]), ['cluster', 'job_db_inx'])
+
+    log.logger.info('Calculated the efficiency of {} jobs, {} with step accounting'
+                    .format(len(jobs_df), jobs_df['total_cpu'].notna().sum()))
+    return len(jobs_df)
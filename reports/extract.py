@@ -0,0 +1,351 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from config import db
+from config import cfg
+from reports import log, cache, catalog, scoping, rollup, utilisation, efficiency, nodes, instrument
+
+
+# Determine the root of the project location
+script_path = os.path.realpath(__file__)
+project_path, report_path = script_path.split(cfg.project_code)
+watermark_path = os.path.join(project_path, 'scratch', 'watermarks.json')
+watermark_lock = threading.Lock()
+
+# The connection pool, and the process it was made in as a forked worker can't
+# share the connections of its parent
+pool = None
+pool_pid = None
+
+# The slurmdbd tables we keep in the local cache, for each of the clusters in
+# db.clusters. Only finished jobs and events are cached as their rows no longer
+# change once time_end has been set. The rows are ordered by the watermark so an
+# interrupted fetch can carry on where it stopped. The rows of every cluster are
+# kept in the same cache with the name of the cluster in the cluster column.
+# The jobs which haven't finished, pending or running, are the queue, and the events
+# which haven't ended, e.g. a node which is still down, are the open events. Their
+# rows change, so they have no watermark and are fetched whole each time as a
+# snapshot, along with the time they were fetched.
+tables = {
+    'job': {'query': """SELECT t1.job_db_inx,
+        t1.id_job,
+        t1.id_assoc,
+        t1.id_user,
+        t1.account,
+        t1.partition,
+        t1.state,
+        t1.exit_code,
+        t1.cpus_req,
+        t1.mem_req,
+        t1.nodes_alloc,
+        t1.nodelist,
+        t1.timelimit,
+        t1.time_submit,
+        t1.time_eligible,
+        t1.time_start,
+        t1.time_end,
+        t1.tres_req,
+        t1.tres_alloc
+        FROM {cluster}_job_table AS t1
+        WHERE t1.time_end <> 0
+        AND t1.time_end >= {watermark}
+        ORDER BY t1.time_end""",
+            'key': ['cluster', 'job_db_inx'],
+            'watermark': 'time_end'},
+    'queue': {'query': """SELECT t1.job_db_inx,
+        t1.id_job,
+        t1.id_assoc,
+        t1.account,
+        t1.partition,
+        t1.state,
+        t1.nodelist,
+        t1.time_submit,
+        t1.time_eligible,
+        t1.time_start,
+        t1.tres_req,
+        t1.tres_alloc
+        FROM {cluster}_job_table AS t1
+        WHERE t1.time_end = 0""",
+              'key': ['cluster', 'job_db_inx'],
+              'watermark': None},
+    'event': {'query': """SELECT t1.node_name,
+        t1.reason,
+        t1.state,
+        t1.time_start,
+        t1.time_end
+        FROM {cluster}_event_table AS t1
+        WHERE t1.time_end <> 0
+        AND t1.time_end >= {watermark}
+        ORDER BY t1.time_end""",
+              'key': ['cluster', 'node_name', 'time_start'],
+              'watermark': 'time_end'},
+    'open_event': {'query': """SELECT t1.node_name,
+        t1.reason,
+        t1.state,
+        t1.time_start
+        FROM {cluster}_event_table AS t1
+        WHERE t1.time_end = 0""",
+                   'key': ['cluster', 'node_name', 'time_start'],
+                   'watermark': None},
+    'step': {'query': """SELECT t1.job_db_inx,
+        t1.id_step,
+        t1.step_het_comp,
+        t1.time_start,
+        t1.time_end,
+        t1.user_sec,
+        t1.user_usec,
+        t1.sys_sec,
+        t1.sys_usec,
+        t1.tres_usage_in_max
+        FROM {cluster}_step_table AS t1
+        WHERE t1.time_end <> 0
+        AND t1.time_end >= {watermark}
+        ORDER BY t1.time_end""",
+             'key': ['cluster', 'job_db_inx', 'id_step', 'step_het_comp'],
+             'watermark': 'time_end'},
+    'assoc': {'query': """SELECT t1.id_assoc,
+        t1.user,
+        t1.acct,
+        t1.partition,
+        t1.deleted,
+        t1.mod_time
+        FROM {cluster}_assoc_table AS t1
+        WHERE t1.mod_time >= {watermark}
+        ORDER BY t1.mod_time""",
+              'key': ['cluster', 'id_assoc'],
+              'watermark': 'mod_time'},
+}
+
+# The derived tables, with the tables they're built from and the function which
+# brings them up to date
+updates = {'rollup': rollup.update,
+           'rollup_sketch': rollup.update,
+           'usage': utilisation.update,
+           'efficiency': efficiency.update,
+           'node': nodes.update}
+derived = {table: (catalog.derived[table], update) for table, update in updates.items()}
+
+
+# The name of a slurmdbd table of a cluster, the first configured by default
+def table_name(table, cluster=None):
+    return '{}_{}_table'.format(cluster or db.clusters[0], table)
+
+
+# Take a connection from the pool, which close() returns it to
+def connect():
+    global pool, pool_pid
+    if pool is None or pool_pid != os.getpid():
+        # The connector is only needed when the database is used
+        import mariadb
+
+        # Connect using the credentials from the config file
+        pool = mariadb.ConnectionPool(pool_name='reports-{}'.format(os.getpid()),
+                                      pool_size=db.pool_size,
+                                      host=db.hostname,
+                                      port=db.port,
+                                      database=db.database,
+                                      user=db.username,
+                                      password=db.password)
+        pool_pid = os.getpid()
+
+    return pool.get_connection()
+
+
+def pooled(function, *args):
+    conn = connect()
+    try:
+        return function(conn, *args)
+    finally:
+        conn.close()
+
+
+# Run independent queries at the same time, each on its own connection from the
+# pool, and return their results by name. The calls are given as
+# {name: (function, args)} and each function is called as function(conn, *args).
+# The connector blocks, so the calls run in threads.
+def concurrently(calls):
+    with ThreadPoolExecutor(max_workers=db.pool_size) as threads:
+        futures = {name: threads.submit(pooled, function, *args) for name, (function, args) in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def load_watermarks():
+    if not os.path.exists(watermark_path):
+        return {}
+
+    with open(watermark_path) as file:
+        return json.load(file)
+
+
+def save_watermark(name, value):
+    # The tables are fetched at the same time, so only save one mark at a time
+    with watermark_lock:
+        watermarks = load_watermarks()
+        watermarks[name] = value
+
+        # Write to a temporary file first so an interrupted run can't corrupt the marks
+        temp_path = watermark_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(watermarks, file, indent=2, sort_keys=True)
+        os.replace(temp_path, watermark_path)
+
+
+# Stream the rows of a query in chunks through an unbuffered cursor, so the rows
+# stay on the server until they're needed and only one chunk is held in memory
+def stream(conn, query, chunk_size=None):
+    cursor = conn.cursor(buffered=False)
+    cursor.execute(query)
+    columns = [column[0] for column in cursor.description]
+
+    while True:
+        rows = cursor.fetchmany(chunk_size or db.chunk_size)
+        if len(rows) == 0:
+            break
+        yield cache.typed(pd.DataFrame.from_records(rows, columns=columns))
+
+    cursor.close()
+
+
+# Fetch the rows of a cluster past the stored high-water mark and merge them into
+# the cache. The query must contain {cluster} and {watermark} placeholders, e.g.
+# "FROM {cluster}_job_table ... AND t1.time_end >= {watermark}", where the watermark
+# is 0 on the first run, and be ordered by the watermark column. The rows from
+# db.lookback seconds before the mark are fetched again, as slurmdbd can record a
+# job late with its original end time, e.g. after it was down, and the rows fetched
+# again are replaced using the key columns, which should include the cluster.
+def incremental(conn, query, table, key, watermark='time_end', cluster=None):
+    cluster = cluster or db.clusters[0]
+    name = '.'.join([cluster, table])
+    first_mark = last_mark = load_watermarks().get(name, 0)
+
+    # Without any rows of the cluster in the cache, e.g. after it was cleared while
+    # the marks were kept, there is nothing to merge into, so start from the beginning
+    if cache.latest(table, watermark, [cluster])[cluster] is None:
+        first_mark = last_mark = 0
+
+    since = max(int(last_mark) - db.lookback, 0)
+    rows = 0
+    with instrument.stage('fetch', table=table, cluster=cluster) as stage:
+        for delta_df in stream(conn, query.format(cluster=cluster, watermark=since)):
+            # Store the merged data before moving the watermark on
+            cache.merge(table, cache.typed(delta_df.assign(cluster=cluster)), key)
+            last_mark = max(last_mark, int(delta_df[watermark].max()))
+            save_watermark(name, last_mark)
+            rows += len(delta_df)
+        stage.measure(rows=rows)
+
+    log.logger.info('Fetched {} rows for {} past watermark {}, from {}'.format(rows, name, first_mark, since))
+    return rows
+
+
+# Replace the rows of a cluster in a table with all those of a query, along with the
+# time they were fetched, for the small tables without a watermark
+def snapshot(conn, query, table, cluster=None):
+    cluster = cluster or db.clusters[0]
+    fetched = int(time.time())
+    with instrument.stage('fetch', table=table, cluster=cluster) as stage:
+        cursor = conn.cursor()
+        cursor.execute(query.format(cluster=cluster))
+        snapshot_df = pd.DataFrame.from_records(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+        cursor.close()
+        cache.replace(table, cluster, cache.typed(snapshot_df.assign(time_fetched=fetched)))
+        stage.measure(rows=len(snapshot_df))
+
+    log.logger.info('Fetched {} rows for {}.{}'.format(len(snapshot_df), cluster, table))
+    return len(snapshot_df)
+
+
+# Bring a cached table up to date with the database of a cluster
+def sync(conn, cluster, table):
+    if tables[table]['watermark'] is None:
+        return snapshot(conn, tables[table]['query'], table, cluster)
+
+    return incremental(conn, tables[table]['query'], table, tables[table]['key'],
+                       tables[table]['watermark'], cluster)
+
+
+def derive(table_update):
+    with instrument.stage(table_update.__module__.rsplit('.', 1)[-1]) as stage:
+        rows = table_update()
+        stage.measure(rows=rows)
+        return rows
+
+
+# Bring the cached tables up to date with the database of each cluster if it's
+# enabled, then recalculate any derived tables from them. The tables are fetched at
+# the same time along with the derived tables which don't need them, so the fetch
+# takes about as long as the slowest query, and then the other derived tables are
+# recalculated at the same time.
+def update(tables):
+    # A cache in an older layout is fetched again from the start
+    if cache.upgrade() and os.path.exists(watermark_path):
+        os.remove(watermark_path)
+
+    sources = []
+    updates = {}
+    for table in tables:
+        table_sources, table_update = derived.get(table, ([table], None))
+        sources += [source for source in table_sources if source not in sources]
+        if table_update is not None:
+            updates[table_update] = len(table_sources) > 0
+
+    with ThreadPoolExecutor(max_workers=db.pool_size) as threads:
+        futures = [threads.submit(derive, table_update) for table_update, dependent in updates.items() if not dependent]
+        if db.use_db_server:
+            futures += [threads.submit(pooled, sync, cluster, table) for cluster in db.clusters for table in sources]
+        for future in futures:
+            future.result()
+
+        futures = [threads.submit(derive, table_update) for table_update, dependent in updates.items() if dependent]
+        for future in futures:
+            future.result()
+
+
+# Read the columns of each table from the cache, only reading the rows in the scope
+# if one is given
+def read(tables, scope=None):
+    frames = {}
+    for table, columns in tables.items():
+        with instrument.stage('read', table=table) as stage:
+            since, until = scoping.bounds(table, scope)
+            frames[table] = cache.read(table, columns=columns, since=since, until=until,
+                                       filters=scoping.predicates(table, scope))
+            stage.measure(frames[table])
+
+    return frames
+
+
+# Load the columns a report needs from the cached tables, syncing them with the
+# database first if enabled. Frames which have already been loaded, e.g. by the
+# runner, are reused rather than read again.
+def load(tables, frames=None, scope=None):
+    if frames is None:
+        update(tables)
+        frames = read(tables, scope)
+
+    return {table: frames[table][columns] for table, columns in tables.items()}
+
+
+# Calculate percentiles (0-100) of an expression over the job table of a cluster for
+# each group on the server, so only one row per group is returned rather than one
+# per job. The result has the same layout as misc.percentiles().
+@instrument.timed
+def percentiles(conn, where, by, column, expression, points=range(0, 101), cluster=None):
+    points = list(points)
+    windows = ['PERCENTILE_CONT({:.2f}) WITHIN GROUP (ORDER BY {}) OVER (PARTITION BY t1.{}) AS p{:d}'
+               .format(point / 100.0, expression, by, point) for point in points]
+
+    query = """SELECT DISTINCT t1.{by},
+        {windows}
+        FROM {table} AS t1
+        WHERE {where}""".format(by=by, windows=',\n        '.join(windows), table=table_name('job', cluster),
+                                  where=where)
+
+    table = pd.read_sql(sql=query, con=conn)
+    table = table.melt(id_vars=by, var_name='percentile', value_name=column)
+    table['percentile'] = table['percentile'].str[1:].astype(int)
+    table[column] = table[column].astype(float).astype(int)
+    return table.sort_values([by, 'percentile'], ignore_index=True)
@@ -0,0 +1,204 @@
+import contextlib
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import numpy as np
+import pandas as pd
+from config import cfg
+from reports import log
+
+
+# Record the duration, rows, frame memory and peak RSS of the stages of the report
+# pipeline as JSON lines next to the log. When disabled a stage costs one check.
+enabled = cfg.instrument
+metrics_path = os.path.splitext(log.log_path)[0] + '.jsonl'
+
+# The records of this process since they were last collected, and the stages
+# which are currently running in each thread, outermost first, along with how
+# many are running in every thread
+records = []
+local = threading.local()
+opened = 0
+opened_lock = threading.Lock()
+
+
+def running():
+    if not hasattr(local, 'running'):
+        local.running = []
+
+    return local.running
+
+
+# The peak resident memory of this process in bytes. On Linux this is the high-water
+# mark since the last reset_peak_rss(), elsewhere it is the peak since the process started.
+def peak_rss():
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+class Stage:
+    def __init__(self, name, labels):
+        # Nested stages carry the labels of the stages they run in, e.g. the report
+        self.record = {'stage': name}
+        if len(running()) > 0:
+            self.record.update((key, value) for key, value in running()[-1].record.items()
+                               if key not in ('stage', 'time', 'seconds', 'rows', 'memory', 'peak_rss'))
+        self.record.update(labels)
+        self.peak = 0
+
+    # Record the number of rows and the memory used by a frame or series, or a dict of frames
+    def measure(self, data=None, rows=None):
+        if not enabled:
+            return
+
+        if isinstance(data, dict):
+            data = [frame for frame in data.values() if isinstance(frame, (pd.DataFrame, pd.Series))]
+        elif isinstance(data, (pd.DataFrame, pd.Series)):
+            data = [data]
+
+        if data is not None:
+            self.record['rows'] = sum(len(frame) for frame in data)
+            self.record['memory'] = int(sum(np.sum(frame.memory_usage(index=True, deep=True)) for frame in data))
+        if rows is not None:
+            self.record['rows'] = rows
+
+
+# A stage which isn't recorded
+disabled = Stage(None, {})
+
+
+def write(record):
+    if metrics_path is None:
+        return
+
+    with open(metrics_path, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+# Time a stage of the pipeline, labelled with e.g. the report or table, and record
+# it when the block finishes. The stage can also measure the data it produces:
+#     with instrument.stage('read', table=table) as stage:
+#         df = ...
+#         stage.measure(df)
+@contextlib.contextmanager
+def stage(name, **labels):
+    if not enabled:
+        yield disabled
+        return
+
+    global opened
+    current = Stage(name, labels)
+    stages = running()
+
+    # The high-water mark is shared by the whole process, so it's only reset while
+    # no other thread is in a stage, e.g. not while the tables are fetched in
+    # threads. Otherwise the peak is that of the process while the stage ran.
+    with opened_lock:
+        if opened == len(stages):
+            if len(stages) > 0:
+                stages[-1].peak = max(stages[-1].peak, peak_rss())
+            reset_peak_rss()
+        opened += 1
+
+    stages.append(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        stages.pop()
+        with opened_lock:
+            opened -= 1
+
+        # The high-water mark is reset by the nested stages, so include their peaks
+        current.peak = max(current.peak, peak_rss())
+        if len(stages) > 0:
+            stages[-1].peak = max(stages[-1].peak, current.peak)
+
+        current.record.update(time=round(time.time(), 3),
+                              seconds=round(time.perf_counter() - started, 6),
+                              peak_rss=current.peak)
+        records.append(current.record)
+        write(current.record)
+
+
+# Record each call of a function as a stage named after it, measuring the frame or
+# series it returns
+def timed(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+
+        with stage(function.__qualname__) as current:
+            result = function(*args, **kwargs)
+            if isinstance(result, (pd.DataFrame, pd.Series)):
+                current.measure(result)
+            return result
+
+    return wrapper
+
+
+# Return and clear the records of this process, e.g. to send them from a worker
+def collect():
+    collected = records[:]
+    records.clear()
+    return collected
+
+
+# Write the records in the Prometheus text format to cfg.prometheus_textfile, for
+# the node_exporter textfile collector. Repeated stages with the same labels are
+# added together, except for the memory and peak RSS which keep the largest.
+def export(path=None):
+    path = path or cfg.prometheus_textfile
+    if not enabled or not path or len(records) == 0:
+        return
+
+    df = pd.DataFrame(records)
+    values = [column for column in ['seconds', 'rows', 'memory', 'peak_rss'] if column in df]
+    labels = [column for column in df.columns if column not in values + ['time']]
+    df[labels] = df[labels].fillna('').astype(str)
+    groups = df.groupby(labels, sort=True)
+    df = pd.concat({column: groups[column].max() if column in ('memory', 'peak_rss')
+                    else groups[column].sum(min_count=1) for column in values}, axis=1).reset_index()
+
+    metrics = {'seconds': ('reports_stage_seconds', 'Wall time of the report pipeline stages'),
+               'rows': ('reports_stage_rows', 'Rows produced by the report pipeline stages'),
+               'memory': ('reports_stage_memory_bytes', 'Memory of the frames produced by the stages'),
+               'peak_rss': ('reports_stage_peak_rss_bytes', 'Peak resident memory during the stages')}
+
+    lines = []
+    for column in values:
+        metric, description = metrics[column]
+        lines += ['# HELP {} {}'.format(metric, description), '# TYPE {} gauge'.format(metric)]
+        for row in df[df[column].notna()].itertuples(index=False):
+            row = row._asdict()
+            selector = ','.join('{}="{}"'.format(label, row[label].replace('"', '\\"'))
+                                for label in labels if row[label] != '')
+            lines.append('{}{{{}}} {}'.format(metric, selector, row[column]))
+    lines += ['# HELP reports_last_run_timestamp_seconds Time the reports last finished',
+              '# TYPE reports_last_run_timestamp_seconds gauge',
+              'reports_last_run_timestamp_seconds {:.0f}'.format(time.time())]
+
+    # The collector may read the file at any time, so replace it in one step
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
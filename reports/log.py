@@ -15,10 +15,11 @@ logger.setLevel(logging.DEBUG)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s',
                               '%Y-%m-%d %H:%M')
 
+# The log file isn't opened until the first message, so importing is cheap
 if sys.stdout.isatty():
     handler = logging.StreamHandler()
 else:
-    handler = logging.FileHandler(log_path)
+    handler = logging.FileHandler(log_path, delay=True)
 
 handler.setFormatter(formatter)
 logger.addHandler(handler)
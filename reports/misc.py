@@ -1,26 +1,34 @@
-import os
-from subprocess import run, PIPE
-import sys
+import numpy as np
+import pandas as pd
 from config import cfg
-import shlex
+from reports import instrument
 
 
-def node_list():
-    # Determine the root of the project location
-    script_path = os.path.realpath(__file__)
-    project_path, report_path = script_path.split(cfg.project_code)
-    scratch_path = os.path.join(project_path, 'scratch', 'node_list.csv')
+# Convert epoch seconds to naive datetimes in the reporting timezone
+@instrument.timed
+def to_datetime(epochs):
+    return pd.to_datetime(epochs, unit='s', utc=True).dt.tz_convert(cfg.timezone).dt.tz_localize(None)
 
-    cmd = 'sinfo -ahN -o "%n|%P|%c|%m|%G"'
-    cmd = shlex.split(cmd)
-    proc = run(cmd, stdout=PIPE)
-    cmd = 'grep -v "rc\*"'
-    cmd = shlex.split(cmd)
-    with open(scratch_path, 'w') as file:
-        proc = run(cmd, input=proc.stdout, stdout=file)
 
-    if proc.returncode != 0:
-        sys.exit(1)
+# Convert naive datetimes in the reporting timezone to epoch seconds
+def to_epoch(datetimes):
+    return datetimes.dt.tz_localize(cfg.timezone).astype('int64') // 10 ** 9
+
+
+# The epoch of the start of the local day of an epoch
+def day_start(epoch):
+    return int(to_epoch(to_datetime(pd.Series([epoch])).dt.normalize()).iloc[0])
+
+
+# Replace any NA with a value, adding the value to the categories where needed
+def fillna(df, value=0):
+    for column in df.columns[df.isna().any()]:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].cat.add_categories([value]).fillna(value)
+        else:
+            df[column] = df[column].fillna(value)
+
+    return df
 
 
 def convert_minutes_to_dhhmm(time):
@@ -37,3 +45,15 @@ def percentile(n):
         return int(x.quantile(n))
     percentile_.__name__ = 'percentile_{:02.0f}'.format(n * 100)
     return percentile_
+
+
+# Calculate a table of percentiles (0-100) of a column for each group in one pass.
+# Each group is sorted once rather than once per percentile as with percentile(n).
+@instrument.timed
+def percentiles(df, by, column, points=range(0, 101)):
+    points = list(points)
+    table = df.groupby(by, observed=True)[column].quantile(np.array(points) / 100.0)
+    table.index = table.index.set_names([by, 'percentile'])
+    table = table.astype(int).reset_index()
+    table['percentile'] = np.tile(points, len(table) // len(points))
+    return table
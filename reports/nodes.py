@@ -0,0 +1,85 @@
+import io
+import shutil
+from subprocess import run, PIPE
+import hostlist
+import pandas as pd
+from config import db
+from config import cfg
+from reports import log, cache
+
+
+# The node attributes reported by sinfo, one line per node and partition
+sinfo_command = ['sinfo', '-ahN', '-o', '%n|%P|%c|%m|%G']
+sinfo_columns = ['node_name', 'partition', 'cpus', 'memory', 'gres']
+
+
+# Run sinfo, on the given cluster when several are configured
+def sinfo(cluster=None):
+    command = sinfo_command
+    if cluster is not None and len(db.clusters) > 1:
+        command = command + ['-M', cluster]
+
+    proc = run(command, stdout=PIPE, text=True, check=True)
+    return proc.stdout
+
+
+# Parse the sinfo output into one row per node, with the partitions it belongs to
+# joined by commas, its CPUs, memory (MB), GRES string and number of GPUs
+def parse(text):
+    # sinfo -M starts with a line naming the cluster
+    text = '\n'.join(line for line in text.splitlines() if not line.startswith('CLUSTER:'))
+    df = pd.read_csv(io.StringIO(text), sep='|', names=sinfo_columns, dtype=str, keep_default_na=False)
+
+    # The default partition is marked with a *, and nodes without GRES show (null)
+    df['partition'] = df['partition'].str.rstrip('*')
+    df['gres'] = df['gres'].replace('(null)', '')
+    df = df[~df['partition'].isin(cfg.exclude_partitions)]
+
+    df['cpus'] = pd.to_numeric(df['cpus'], errors='coerce').fillna(0).astype(int)
+    df['memory'] = pd.to_numeric(df['memory'], errors='coerce').fillna(0).astype(int)
+    gpus = df['gres'].str.extractall(r'gpu(?::[^:,(]+)?:(\d+)')[0].astype(int).groupby(level=0).sum()
+    df['gpus'] = gpus.reindex(df.index, fill_value=0)
+
+    return df.groupby('node_name', sort=True).agg(partitions=('partition', ','.join),
+                                                  cpus=('cpus', 'max'),
+                                                  memory=('memory', 'max'),
+                                                  gres=('gres', 'first'),
+                                                  gpus=('gpus', 'max')).reset_index()
+
+
+# Cache the node inventory of every cluster, only running sinfo again once the cached
+# copy is older than cfg.node_ttl seconds. A stale copy is kept if sinfo isn't
+# available here.
+def update():
+    age = cache.age('node')
+    if age is not None and (age < cfg.node_ttl or shutil.which(sinfo_command[0]) is None):
+        return 0
+
+    if shutil.which(sinfo_command[0]) is None:
+        log.logger.warning('sinfo is not available and there is no cached node inventory')
+        return 0
+
+    nodes_df = pd.concat([parse(sinfo(cluster)).assign(cluster=cluster) for cluster in db.clusters],
+                         ignore_index=True)
+    cache.write('node', nodes_df)
+    log.logger.info('Cached the inventory of {} nodes'.format(len(nodes_df)))
+    return len(nodes_df)
+
+
+def expand(nodelist):
+    if nodelist in ('', 'None assigned', None):
+        return []
+
+    return hostlist.expand_hostlist(nodelist)
+
+
+def compress(node_names):
+    return hostlist.collect_hostlist(list(node_names))
+
+
+# Expand the nodelist of each job to one row per node so jobs can be joined to the
+# inventory. Each distinct hostlist is only expanded once.
+def job_nodes(jobs_df, column='nodelist'):
+    nodelists = jobs_df[column].astype(str)
+    expanded = {nodelist: expand(nodelist) for nodelist in nodelists.unique()}
+    return jobs_df.assign(node_name=nodelists.map(expanded)).explode('node_name', ignore_index=True)
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from config import cfg
+from reports import instrument
+
+
+# Turn job intervals into the exact step function of the resources in use in each
+# group. Each job adds its resources at time_start and removes them at time_end,
+# so after one sort a cumulative sum gives the level from each change onwards.
+@instrument.timed
+def steps(jobs_df, by, columns, start='time_start', end='time_end'):
+    starts_df = jobs_df[by + [start] + columns].rename(columns={start: 'time'})
+    ends_df = jobs_df[by + [end] + columns].rename(columns={end: 'time'})
+    ends_df[columns] = -ends_df[columns]
+
+    deltas_df = pd.concat([starts_df, ends_df], ignore_index=True)
+    deltas_df = deltas_df.groupby(by + ['time'], observed=True, sort=True)[columns].sum().reset_index()
+    deltas_df[columns] = deltas_df.groupby(by, observed=True)[columns].cumsum()
+    return deltas_df
+
+
+# Add the jobs of the queue which haven't finished to the finished jobs, as though
+# they end when the queue was fetched, so the intervals don't stop short at the last
+# job to finish. Without it the jobs still running are missing from the most recent
+# times, back to the start of the longest running job.
+def with_queue(jobs_df, queue_df):
+    if len(queue_df) == 0:
+        return jobs_df
+
+    queue_df = queue_df.assign(time_end=queue_df['time_fetched']).drop(columns='time_fetched')
+    return pd.concat([jobs_df, queue_df], ignore_index=True)
+
+
+# The integral of a step function at the given times, where the level is levels[i]
+# from times[i] until the next change and 0 before the first
+def integrate(times, levels, at):
+    areas = np.concatenate([[0], np.cumsum(levels[:-1] * np.diff(times))])
+    index = np.searchsorted(times, at, side='right') - 1
+    inside = index >= 0
+    index = np.maximum(index, 0)
+    return np.where(inside, areas[index] + levels[index] * (at - times[index]), 0)
+
+
+# The bucket sizes to average over, and their length in seconds
+buckets = {'min': 60, 'h': 3600, 'D': 86400}
+
+
+# The smallest bucket which doesn't need more points than the plot is wide
+def frequency(since, until, width=None):
+    return next((freq for freq, seconds in buckets.items() if (until - since) / seconds <= (width or cfg.graph_width)),
+                'D')
+
+
+# The epochs of the bucket edges of a pandas frequency covering [since, until). The
+# edges are stepped in local time, so days follow the clock changes.
+def edges(since, until, freq='h'):
+    first = pd.Timestamp(since, unit='s', tz='UTC').tz_convert(cfg.timezone)
+    first = first.floor(freq, ambiguous=True, nonexistent='shift_backward')
+    last = pd.Timestamp(until, unit='s', tz='UTC').tz_convert(cfg.timezone)
+    times = pd.date_range(first, last + pd.tseries.frequencies.to_offset(freq), freq=freq).asi8 // 10 ** 9
+    return times[:np.searchsorted(times, until, side='left') + 1]
+
+
+# Average the step functions of each group over buckets of a pandas frequency,
+# e.g. 'min', 'h' or 'D', in the reporting timezone. Every group has a row for
+# every bucket start in [since, until), where the buckets cover all the steps
+# by default.
+@instrument.timed
+def resample(steps_df, by, columns, freq='h', since=None, until=None):
+    since = steps_df['time'].min() if since is None else since
+    until = steps_df['time'].max() if until is None else until
+    bucket_edges = edges(since, until, freq)
+
+    tables = []
+    for group, group_df in steps_df.groupby(by, observed=True, sort=True):
+        times = group_df['time'].to_numpy()
+        table = {'time': bucket_edges[:-1]}
+        for column in columns:
+            areas = integrate(times, group_df[column].to_numpy(dtype=float), bucket_edges)
+            table[column] = np.diff(areas) / np.diff(bucket_edges)
+        table_df = pd.DataFrame(table)
+        for name, value in zip(by, group if isinstance(group, tuple) else (group,)):
+            table_df.insert(0, name, value)
+        tables.append(table_df)
+
+    if len(tables) == 0:
+        return pd.DataFrame(columns=by + ['time'] + columns)
+
+    return pd.concat(tables, ignore_index=True)[by + ['time'] + columns]
@@ -0,0 +1,113 @@
+import base64
+import gzip
+import os
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+import plotly.offline
+from config import cfg
+from reports import instrument
+
+
+config = {'displayModeBar': True,
+          'displaylogo': False,
+          'modeBarButtonsToRemove': ['lasso2d']}
+
+# The numeric types Plotly.js can read from base64 encoded typed arrays
+typed_arrays = {np.dtype('float64'): 'f8', np.dtype('float32'): 'f4',
+                np.dtype('int32'): 'i4', np.dtype('uint32'): 'u4',
+                np.dtype('int16'): 'i2', np.dtype('uint16'): 'u2',
+                np.dtype('int8'): 'i1', np.dtype('uint8'): 'u1'}
+
+
+# Replace the numeric arrays in a figure with base64 encoded typed arrays, which are
+# smaller and faster to load than the same numbers written out as JSON text
+def encode(value):
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind in 'iuf':
+        if value.dtype not in typed_arrays:
+            # Plotly.js has no 64 bit integers
+            value = value.astype('float64')
+        return {'dtype': typed_arrays[value.dtype],
+                'bdata': base64.b64encode(np.ascontiguousarray(value).tobytes()).decode('ascii')}
+
+    return value
+
+
+# Write one copy of plotly.js to the output directory for every report to share.
+# The runner writes it before starting the workers, so they only find it there.
+def write_plotlyjs(output_path):
+    plotlyjs_name = 'plotly-{}.min.js'.format(plotly.offline.get_plotlyjs_version())
+    plotlyjs_file = os.path.join(output_path, plotlyjs_name)
+    if not os.path.exists(plotlyjs_file):
+        os.makedirs(output_path, exist_ok=True)
+        write_file(plotlyjs_file, plotly.offline.get_plotlyjs())
+
+    return plotlyjs_name
+
+
+# Write a file, and a gzip compressed copy next to it if enabled, so a web server
+# can send the compressed copy as is. Each copy is written to a temporary file of
+# its own process first, as the workers may write the same file at the same time.
+def write_file(output_file, text):
+    data = text.encode('utf-8')
+    copies = [(output_file, data)]
+    if cfg.output_gzip:
+        copies.append((output_file + '.gz', gzip.compress(data)))
+
+    for file_path, content in copies:
+        temp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+        with open(temp_path, 'wb') as file:
+            file.write(content)
+        os.replace(temp_path, file_path)
+
+
+# A figure with a message in place of a chart, e.g. for a scope which no rows match
+def message(title, text):
+    fig = go.Figure()
+    fig.add_annotation(text=text, x=0.5, y=0.5, xref='paper', yref='paper', showarrow=False, font={'size': 20})
+    fig.update_xaxes(visible=False)
+    fig.update_yaxes(visible=False)
+    fig.update_layout(title={'text': title, 'x': 0.5, 'xanchor': 'center'},
+                      height=cfg.graph_height, width=cfg.graph_width)
+    return fig
+
+
+# Convert a report's figure to HTML which loads the shared plotly.js, running the
+# script given once the figure is drawn
+def render(fig, plotlyjs_name, script=None):
+    # Only the trace data is encoded, as Plotly.js doesn't decode typed arrays in the layout
+    fig_json = fig.to_plotly_json()
+    fig_json['data'] = encode(fig_json['data'])
+    return pio.to_html(fig_json, config=config, include_plotlyjs=plotlyjs_name, post_script=script,
+                        validate=False, full_html=True)
+
+
+# The name of the file with the detail of a report, next to its page
+def detail_name(report_name):
+    return '.'.join([report_name, 'detail', 'json'])
+
+
+# Write the detail of a report as JSON with the columns and the rows as lists, for
+# its page to load when it's needed rather than with the page
+def write_detail(output_path, report_name, detail_df):
+    write_file(os.path.join(output_path, detail_name(report_name)), detail_df.to_json(orient='split', index=False))
+
+
+# Save a report's figure as HTML using the shared plotly.js, along with its detail
+# and the script which loads it
+def write(fig, output_path, report_name, detail=None, script=None):
+    os.makedirs(output_path, exist_ok=True)
+    with instrument.stage('render'):
+        html = render(fig, write_plotlyjs(output_path), script)
+
+    output_name = '.'.join([report_name, 'html'])
+    output_file = os.path.join(output_path, output_name)
+    with instrument.stage('write'):
+        write_file(output_file, html)
+        if detail is not None:
+            write_detail(output_path, report_name, detail)
+    return output_file
@@ -0,0 +1,156 @@
+import os
+import pathlib
+import sys
+from config import db
+from config import cfg
+from reports import log, catalog, scoping, extract, output, results, instrument
+
+
+# Every Report subclass, by the name of the module it's defined in
+registry = {}
+
+
+# The base of every report. A report declares the data it needs and builds a figure
+# from it; fetching, caching, filtering and saving the output are handled here.
+# A report covers every cluster in db.clusters combined, or the one it's given, and
+# the full history or the scope it's given (see scoping.py), such as since, until and
+# a list of partitions. The scope is pushed down when the frames are read, so frames
+# given to run() must have been read for the same scope.
+class Report:
+    # The cached tables and columns the report reads. The table sets the grain of the
+    # data, e.g. 'job' for one row per job or 'rollup' for one row per day and group.
+    # The first table is the one the report draws, which it has nothing to draw
+    # without, where the others add to it, e.g. the node inventory or the queue.
+    tables = {}
+
+    # Row filters for each table as pandas query expressions, which may use the .str
+    # accessor. The filtered frame is shared by the reports which use the same filter.
+    filters = {}
+
+    # Set when build() can have the database aggregate the data instead, in which
+    # case nothing is loaded from the cache when db.aggregate_on_server is enabled
+    server_aggregation = False
+
+    # The full detail of a chart which only draws a summary of it, set by build() to
+    # be written next to the page, and a script run by the page, e.g. to load it
+    detail = None
+    script = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        registry[cls.__module__.rsplit('.', 1)[-1]] = cls
+
+    def __init__(self, cluster=None, scope=None):
+        self.cluster = cluster
+        self.scope = {name: value for name, value in (scope or {}).items() if value is not None}
+
+        # Determine the root of the project location
+        script_path = os.path.realpath(sys.modules[type(self).__module__].__file__)
+        project_path, self.report_path = script_path.split(cfg.project_code)
+
+        # Determine the name and location of the output file, with the reports of
+        # a single cluster or a scope in a directory of their own
+        report_path = pathlib.Path(self.report_path)
+        self.name = report_path.stem
+        self.output_path = os.path.join(project_path, 'output', cluster or '', catalog.label(self.scope),
+                                        str(report_path.parent).lstrip(os.path.sep))
+
+    def aggregate_on_server(self):
+        return catalog.aggregate_on_server(self.server_aggregation, self.cluster)
+
+    def requires(self):
+        return catalog.requires(self.tables, self.server_aggregation, self.cluster)
+
+    # Load the filtered frames the report needs. Frames which have already been
+    # loaded, e.g. by the runner, are reused and each filter is only applied once.
+    def load(self, frames=None):
+        tables = self.requires()
+        if frames is None:
+            frames = extract.load(tables, scope=self.scope)
+
+        data = {}
+        for table in tables:
+            expression = self.filters.get(table)
+            if self.cluster is not None:
+                expression = ' and '.join(['cluster == {!r}'.format(self.cluster)]
+                                          + ['({})'.format(expression)] * (expression is not None))
+            if expression is None:
+                data[table] = frames[table][self.tables[table]].copy()
+                continue
+
+            key = (table, expression)
+            if key not in frames:
+                frames[key] = frames[table].query(expression, engine='python')
+            data[table] = frames[key][self.tables[table]].copy()
+
+        return data
+
+    def build(self, frames):
+        raise NotImplementedError
+
+    # Why the report can't be run for its scope, as a table it reads has no column for
+    # one of the filters of the scope, or None when it can
+    def unscoped(self):
+        missing = scoping.unsupported(self.tables, self.scope)
+        if len(missing) == 0:
+            return None
+
+        return ', '.join('the {} table has no {}'.format(table, name) for table, name in missing)
+
+    # Skip the report when it can't be narrowed to its scope, removing the pages
+    # written for the scope before so they aren't published under its label
+    def skip(self):
+        reason = self.unscoped()
+        if reason is None:
+            return False
+
+        log.logger.warning('Skipped {} for the scope {} as {}'.format(
+            '/'.join(filter(None, [self.cluster, self.name])), catalog.label(self.scope), reason))
+        for name in results.files(self.name):
+            pathlib.Path(self.output_path, name).unlink(missing_ok=True)
+        return True
+
+    # Whether the frames loaded have none of the rows the report draws, e.g. for a
+    # scope which matches no rows. The data is aggregated elsewhere when there are
+    # no frames.
+    def empty(self, frames):
+        return len(frames) > 0 and len(next(iter(frames.values()))) == 0
+
+    # The range of a chart, from the scope where it's given and otherwise the data
+    def span(self, since, until):
+        return self.scope.get('since', since), self.scope.get('until', until)
+
+    # Put back the output kept from a run with the same data, code and settings,
+    # returning the path of the page or None if there isn't one
+    def restore(self):
+        return results.restore(results.key(self), self.output_path, self.name)
+
+    def run(self, frames=None):
+        log.logger.info('Starting {} for {} - using DB {}'.format(self.report_path, self.cluster or 'all clusters',
+                                                                 db.use_db_server))
+        if self.skip():
+            return None
+
+        with instrument.stage('report', report=self.name, cluster=self.cluster or 'all'):
+            # Bring the cache up to date before looking for a kept output of the same data
+            if frames is None:
+                extract.update(self.requires())
+            result_key = results.key(self)
+            output_file = results.restore(result_key, self.output_path, self.name)
+            if output_file is not None:
+                log.logger.info('Reused the output of {} as its data is unchanged'.format(self.name))
+                return output_file
+
+            with instrument.stage('load') as stage:
+                data = self.load(frames if frames is not None else extract.read(self.requires(), self.scope))
+                stage.measure(data)
+            with instrument.stage('build'):
+                if self.empty(data):
+                    where = 'the scope {}'.format(catalog.label(self.scope)) if self.scope else 'the cache'
+                    log.logger.warning('No data for {} in {}'.format(self.name, where))
+                    fig = output.message(self.name.replace('_', ' ').title(), 'No data in {}'.format(where))
+                else:
+                    fig = self.build(data)
+            output_file = output.write(fig, self.output_path, self.name, self.detail, self.script)
+            results.store(result_key, self.output_path, self.name)
+            return output_file
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import shutil
+from config import db
+from config import cfg
+from reports import log, cache, scoping, output
+
+
+# The rendered reports are kept under a hash of everything they're built from: the
+# contents of the cached files they read, their declarations and cluster, the
+# settings which change the pages and the code. A report whose hash is kept is
+# copied from here rather than loaded, built and written again. The least recently
+# used results are removed once they take up more than cfg.result_cache_size MB,
+# and 0 turns it off.
+script_path = os.path.realpath(__file__)
+project_path, report_path = script_path.split(cfg.project_code)
+results_path = os.path.join(project_path, 'scratch', 'results')
+digests_path = os.path.join(results_path, 'digests.json')
+
+# The settings which change the pages written, so changing the others, e.g. the
+# workers or the instrumentation, keeps the results
+settings = ['graph_width', 'graph_height', 'timezone', 'sunburst_leaves', 'timeline_events', 'exclude_partitions',
+            'output_gzip']
+
+# Files are hashed a chunk (bytes) at a time
+chunk_size = 1 << 20
+
+# The digests of the cached files by path, size and modification time, so only
+# the files written since the last run are read again, and the digest of the code
+digests = None
+source = None
+
+
+# Hash the contents of a file
+def digest(file_path):
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def load_digests():
+    global digests
+    if digests is None:
+        digests = {}
+        if os.path.exists(digests_path):
+            with open(digests_path) as file:
+                digests = {file_path: value for file_path, value in json.load(file).items()
+                           if os.path.exists(file_path)}
+
+    return digests
+
+
+def save_digests():
+    os.makedirs(results_path, exist_ok=True)
+
+    # Write to a temporary file first, as the workers may save at the same time
+    temp_path = '{}.{}.tmp'.format(digests_path, os.getpid())
+    with open(temp_path, 'w') as file:
+        json.dump(digests, file)
+    os.replace(temp_path, digests_path)
+
+
+# The digests of the cached files of a table a scope reads. A cached file is only
+# rewritten with the same bytes when the rows merged into it were already there.
+def table_digests(table, scope=None):
+    known = load_digests()
+    stamps = []
+    changed = False
+    for file_path in cache.files(table, *scoping.bounds(table, scope)):
+        stat = os.stat(file_path)
+        stamp = '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+        if known.get(file_path, [None])[0] != stamp:
+            known[file_path] = [stamp, digest(file_path)]
+            changed = True
+        stamps.append([os.path.basename(file_path), known[file_path][1]])
+
+    if changed:
+        save_digests()
+    return stamps
+
+
+# Hash the source of the reports package, so any change to the code builds the
+# reports again
+def source_digest():
+    global source
+    if source is None:
+        hasher = hashlib.blake2b(digest_size=16)
+        package_path = os.path.dirname(script_path)
+        for path, directories, names in sorted(os.walk(package_path)):
+            directories.sort()
+            for name in sorted(names):
+                if name.endswith('.py'):
+                    hasher.update(os.path.relpath(os.path.join(path, name), package_path).encode())
+                    hasher.update(digest(os.path.join(path, name)).encode())
+        source = hasher.hexdigest()
+
+    return source
+
+
+# The key of a report's result, or None if it can't be kept, e.g. when the database
+# aggregates its data
+def key(item):
+    if cfg.result_cache_size <= 0 or item.aggregate_on_server():
+        return None
+
+    inputs = {'report': item.name,
+              'cluster': item.cluster,
+              'scope': item.scope,
+              'clusters': db.clusters,
+              'tables': item.requires(),
+              'filters': item.filters,
+              'settings': {name: getattr(cfg, name, None) for name in settings},
+              'source': source_digest(),
+              'data': {table: table_digests(table, item.scope) for table in sorted(item.requires())}}
+
+    return hashlib.blake2b(json.dumps(inputs, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+# The files a report writes next to its page
+def files(report_name):
+    names = ['.'.join([report_name, 'html']), output.detail_name(report_name)]
+    return names + [name + '.gz' for name in names]
+
+
+# Link a file to a new path, or copy it if they're on different file systems
+def link(source_path, target_path):
+    temp_path = '{}.{}.tmp'.format(target_path, os.getpid())
+    try:
+        os.link(source_path, temp_path)
+    except OSError:
+        shutil.copy2(source_path, temp_path)
+    os.replace(temp_path, target_path)
+
+
+# Put back the kept result of a report into its output directory, returning the path
+# of its page or None if there isn't one. The files are hard links to the kept
+# copies, so an output which is already the kept result isn't touched.
+def restore(result_key, output_path, report_name):
+    if result_key is None:
+        return None
+
+    entry_path = os.path.join(results_path, result_key)
+    if not os.path.isdir(entry_path):
+        return None
+
+    os.makedirs(output_path, exist_ok=True)
+    output.write_plotlyjs(output_path)
+    for name in os.listdir(entry_path):
+        target_path = os.path.join(output_path, name)
+        source_path = os.path.join(entry_path, name)
+        if not (os.path.exists(target_path) and os.path.samefile(source_path, target_path)):
+            link(source_path, target_path)
+
+    # Mark the result as used for the eviction
+    os.utime(entry_path)
+    return os.path.join(output_path, '.'.join([report_name, 'html']))
+
+
+# Keep the files a report has just written under its key
+def store(result_key, output_path, report_name):
+    if result_key is None:
+        return
+
+    entry_path = os.path.join(results_path, result_key)
+    temp_path = '{}.{}.tmp'.format(entry_path, os.getpid())
+    os.makedirs(temp_path, exist_ok=True)
+    for name in files(report_name):
+        if os.path.exists(os.path.join(output_path, name)):
+            link(os.path.join(output_path, name), os.path.join(temp_path, name))
+
+    # Another worker may have kept the same result already
+    try:
+        os.rename(temp_path, entry_path)
+    except OSError:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    evict()
+
+
+# Remove the least recently used results until they fit in cfg.result_cache_size MB
+def evict():
+    entries = []
+    for name in os.listdir(results_path):
+        entry_path = os.path.join(results_path, name)
+        if os.path.isdir(entry_path) and not name.endswith('.tmp'):
+            size = sum(os.path.getsize(os.path.join(entry_path, file)) for file in os.listdir(entry_path))
+            entries.append((os.path.getmtime(entry_path), size, entry_path))
+
+    total = sum(size for _, size, _ in entries)
+    limit = cfg.result_cache_size * 2 ** 20
+    for _, size, entry_path in sorted(entries):
+        if total <= limit:
+            break
+        shutil.rmtree(entry_path, ignore_errors=True)
+        total -= size
+        log.logger.debug('Removed the kept result {}'.format(os.path.basename(entry_path)))
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from config import db
+from reports import log, misc, cache, tres
+
+
+# The rollups hold one row per day and combination of these columns for the jobs
+# which ran, with the number of jobs and the sums of their elapsed and wait times.
+# The gpu column is True when the job requested a GPU in its TRES.
+dimensions = ['cluster', 'partition', 'account', 'user', 'state', 'gpu']
+metrics = ['elapsed', 'wait']
+
+# The elapsed and wait times are also kept as mergeable sketches per day, partition
+# and state. Each value is counted in a logarithmic bucket so quantiles of any
+# date range can be estimated by adding the counts, to within this relative
+# accuracy and half a second as they're rounded to whole seconds. Values of up to a
+# second are counted as 0.
+sketch_dimensions = ['cluster', 'partition', 'state']
+accuracy = 0.01
+gamma = (1 + accuracy) / (1 - accuracy)
+
+
+# Find the sketch bucket of each value, with values up to 1 in bucket 0
+def buckets(values):
+    values = np.maximum(np.asarray(values, dtype=float), 1)
+    return np.ceil(np.log(values) / np.log(gamma)).astype(np.int32)
+
+
+# Estimate the value represented by each sketch bucket
+def bucket_values(buckets):
+    values = 2 * np.power(gamma, np.asarray(buckets, dtype=float)) / (gamma + 1)
+    return np.where(np.asarray(buckets) > 0, values, 0)
+
+
+# Calculate the rollups of the jobs of each cluster which ended on or after the start
+# of the last day already rolled up, so the partial last day and any new days are
+# replaced. The days from db.lookback before it are rolled up again for the jobs
+# slurmdbd recorded late, and a cluster without any rollups yet from the start.
+def update():
+    marks = {cluster: None if day is None else misc.day_start(day - db.lookback)
+             for cluster, day in cache.latest('rollup', 'day', db.clusters).items()}
+
+    jobs_df = cache.read_since('job', marks, columns=['cluster', 'id_assoc', 'account', 'partition', 'state',
+                                                      'tres_req', 'time_submit', 'time_start', 'time_end'])
+    jobs_df = jobs_df[(jobs_df['time_start'] < jobs_df['time_end'])
+                      & (jobs_df['time_start'] != 0)
+                      & (jobs_df['partition'] != '')]
+    if len(jobs_df) == 0:
+        return 0
+
+    jobs_df = cache.lookup(jobs_df, 'assoc', ['cluster', 'id_assoc'], ['user'])
+    jobs_df = jobs_df.assign(day=misc.to_epoch(misc.to_datetime(jobs_df['time_end']).dt.normalize()),
+                             gpu=tres.parse(jobs_df['tres_req'], ['gpus'])['gpus'].to_numpy() > 0,
+                             elapsed=jobs_df['time_end'] - jobs_df['time_start'],
+                             wait=(jobs_df['time_start'] - jobs_df['time_submit']).clip(lower=0))
+
+    rollup_df = jobs_df.groupby(['day'] + dimensions, observed=True, dropna=False).agg(
+        jobs=('day', 'size'),
+        elapsed=('elapsed', 'sum'),
+        wait=('wait', 'sum')).reset_index()
+    cache.merge('rollup', cache.typed(rollup_df), ['day'] + dimensions)
+
+    sketch_dfs = []
+    for metric in metrics:
+        sketch_df = jobs_df.assign(metric=metric, bucket=buckets(jobs_df[metric]))
+        sketch_df = sketch_df.groupby(['day'] + sketch_dimensions + ['metric', 'bucket'],
+                                      observed=True).size().reset_index(name='count')
+        sketch_dfs.append(sketch_df)
+    cache.merge('rollup_sketch', cache.typed(pd.concat(sketch_dfs, ignore_index=True)),
+                ['day'] + sketch_dimensions + ['metric', 'bucket'])
+
+    log.logger.info('Rolled up {} jobs over {} days'.format(len(jobs_df), jobs_df['day'].nunique()))
+    return len(jobs_df)
+
+
+# Estimate percentiles (0-100) of a metric for each group by merging the sketches,
+# taking the value at the rank below rather than interpolating between values. The
+# result has the same layout as misc.percentiles().
+def quantiles(sketch_df, by, metric, points=range(0, 101)):
+    sketch_df = sketch_df[sketch_df['metric'] == metric]
+    sketch_df = sketch_df.groupby(by + ['bucket'], observed=True)['count'].sum().reset_index()
+    cumulative = sketch_df.groupby(by, observed=True)['count'].cumsum()
+    total = sketch_df.groupby(by, observed=True)['count'].transform('sum')
+
+    tables = []
+    for point in points:
+        # The first bucket holding the value at the rank of this percentile
+        hit_df = sketch_df[cumulative > point / 100.0 * (total - 1)].groupby(by, observed=True).head(1)
+        tables.append(hit_df.assign(percentile=point))
+
+    table = pd.concat(tables, ignore_index=True)
+    table[metric] = np.rint(bucket_values(table['bucket'])).astype(int)
+    return table[by + ['percentile', metric]].sort_values(by + ['percentile'], ignore_index=True)
@@ -0,0 +1,95 @@
+import importlib
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from reports import log, catalog, extract, output, report, instrument
+
+
+# Import a report module, which registers its report, and create the report for a
+# cluster, or for every cluster combined
+def load_report(name, cluster=None, scope=None):
+    importlib.import_module('.'.join(['reports', 'samples', name]))
+    return report.registry[name](cluster, scope)
+
+
+# The name of a report for a cluster in the log
+def label(name, cluster=None):
+    return name if cluster is None else '/'.join([cluster, name])
+
+
+# Combine the tables and columns each report reads so every table is fetched once
+def combine(reports):
+    return catalog.combine(item.requires() for item in reports)
+
+
+# Render a single report in a worker process. The worker reads its own columns
+# straight from the memory-mapped cache rather than having the frames pickled to it,
+# and sends back its instrumentation records.
+def render(name, cluster=None, scope=None):
+    item = load_report(name, cluster, scope)
+    started = time.time()
+    item.run(extract.read(item.requires(), scope))
+    return time.time() - started, instrument.collect()
+
+
+# Run the reports for each of the clusters given, where None is every cluster
+# combined, over the scope given or the full history
+def run(names, workers=1, clusters=(None,), scope=None):
+    views = [(name, cluster) for cluster in clusters for name in names]
+    reports = [load_report(name, cluster, scope) for name, cluster in views]
+
+    # The reports which can't be narrowed to the scope aren't run for it, rather than
+    # written whole under its label
+    kept = [(view, item) for view, item in zip(views, reports) if not item.skip()]
+    views = [view for view, _ in kept]
+    reports = [item for _, item in kept]
+    tables = combine(reports)
+
+    started = time.time()
+    extract.update(tables)
+    log.logger.info('Updated {} in {:.1f}s'.format(', '.join(tables), time.time() - started))
+
+    # Only the reports whose data, code or settings changed since their output was
+    # kept are loaded and built again
+    pending = [(view, item) for view, item in zip(views, reports) if item.restore() is None]
+    log.logger.info('Reused the output of {} of {} reports'.format(len(views) - len(pending), len(views)))
+    views = [view for view, _ in pending]
+    reports = [item for _, item in pending]
+
+    # Write the plotly.js the pages share before the workers start writing them
+    for output_path in sorted({item.output_path for item in reports}):
+        output.write_plotlyjs(output_path)
+
+    # Carry on with the remaining reports if one fails, but report the failure
+    failed = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(render, name, cluster, scope): label(name, cluster) for name, cluster in views}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    elapsed, records = future.result()
+                except Exception:
+                    log.logger.exception('Failed {}'.format(name))
+                    failed.append(name)
+                    continue
+                instrument.records.extend(records)
+                log.logger.info('Finished {} in {:.1f}s'.format(name, elapsed))
+    else:
+        started = time.time()
+        frames = extract.read(combine(reports), scope)
+        log.logger.info('Loaded {} in {:.1f}s'.format(', '.join(frames), time.time() - started))
+
+        # The reports share the frames, so rows filtered for one are reused by the others
+        for (name, cluster), item in zip(views, reports):
+            name = label(name, cluster)
+            started = time.time()
+            try:
+                item.run(frames)
+            except Exception:
+                log.logger.exception('Failed {}'.format(name))
+                failed.append(name)
+                continue
+            log.logger.info('Finished {} in {:.1f}s'.format(name, time.time() - started))
+
+    instrument.export()
+    return 1 if failed else 0
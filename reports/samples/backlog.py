@@ -0,0 +1,69 @@
+from config import cfg
+import plotly.graph_objects as go
+from plotly.colors import qualitative
+from plotly.subplots import make_subplots
+from reports import misc, occupancy, backlog, report
+
+
+# The trailing window of job starts the wait percentiles are taken over, in seconds
+window = 86400
+colours = qualitative.Plotly
+
+
+class Backlog(report.Report):
+    # Every job with a partition, including those cancelled while pending. The jobs
+    # in the queue are still pending, or were until they started.
+    tables = {'job': ['partition', 'time_submit', 'time_start', 'time_end'],
+              'queue': ['partition', 'time_submit', 'time_start', 'time_fetched']}
+    filters = {'job': "partition != ''", 'queue': "partition != ''"}
+
+    def build(self, frames):
+        jobs_df = occupancy.with_queue(frames['job'], frames['queue'])
+        groups = backlog.index(jobs_df)
+
+        # Sample the queue at the smallest bucket which fits the plot width
+        since, until = self.span(jobs_df.loc[jobs_df['time_submit'] > 0, 'time_submit'].min(),
+                                 jobs_df['time_end'].max())
+        times = occupancy.edges(since, until, occupancy.frequency(since, until))
+
+        depth_df = backlog.depth(groups, times)
+        waits_df = backlog.waits(groups, times, window, [50, 95])
+        depth_df['date'] = misc.to_datetime(depth_df['time'])
+        waits_df['date'] = misc.to_datetime(waits_df['time'])
+
+        # Determine the start and end datetime for the plot
+        start_date = min(depth_df.date)
+        start_date = start_date.strftime('%d/%m/%Y')
+        end_date = max(depth_df.date)
+        end_date = end_date.strftime('%d/%m/%Y')
+
+        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.05)
+        waits = dict(list(waits_df.groupby('partition', observed=True)))
+        for number, (partition, partition_df) in enumerate(depth_df.groupby('partition', observed=True)):
+            colour = colours[number % len(colours)]
+            fig.add_trace(go.Scatter(x=partition_df['date'], y=partition_df['pending'], name=str(partition),
+                                     legendgroup=str(partition), mode='lines', line_color=colour), 1, 1)
+            fig.add_trace(go.Scatter(x=waits[partition]['date'], y=(waits[partition]['p95'] / 3600).round(2),
+                                     name=str(partition), legendgroup=str(partition), mode='lines',
+                                     line_color=colour, showlegend=False, text=waits[partition]['jobs'],
+                                     hovertemplate='%{y} hours from %{text} jobs'), 2, 1)
+
+        fig.update_yaxes(row=1, col=1, title_text='Jobs Pending')
+        fig.update_yaxes(row=2, col=1, title_text='95th Percentile Wait (hours)')
+        fig.update_xaxes(row=2, col=1, title_text='Date')
+        fig.update_layout(title={'text': f'Queue Backlog<br><sup>{start_date} to {end_date}</sup>',
+                                 'y': 0.97,
+                                 'x': 0.5,
+                                 'xanchor': 'center',
+                                 'yanchor': 'top'},
+                          height=cfg.graph_height, width=cfg.graph_width)
+
+        return fig
+
+
+def start(frames=None, **scope):
+    return Backlog(scope=scope).run(frames)
+
+
+if __name__ == '__main__':
+    start()
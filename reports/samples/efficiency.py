@@ -0,0 +1,59 @@
+from config import cfg
+from plotly.subplots import make_subplots
+import plotly.graph_objects as go
+from reports import misc, report
+
+
+class Efficiency(report.Report):
+    # The CPU and memory efficiency of the jobs which ran, as seff reports them
+    tables = {'efficiency': ['account', 'user', 'elapsed', 'cpus', 'total_cpu', 'cpu_efficiency', 'mem_efficiency']}
+    filters = {'efficiency': 'total_cpu.notna()'}
+
+    def build(self, frames):
+        jobs_df = frames['efficiency']
+        jobs_df = jobs_df.astype({'account': str, 'user': str})
+        jobs_df['core_hours'] = jobs_df['elapsed'] * jobs_df['cpus'] / 3600
+        jobs_df['wasted_hours'] = (jobs_df['core_hours'] - jobs_df['total_cpu'] / 3600).clip(lower=0)
+
+        # Only show the accounts and users which held the most core-hours
+        accounts = jobs_df.groupby('account')['core_hours'].sum().nlargest(12).index
+        accounts_df = jobs_df[jobs_df['account'].isin(accounts)]
+
+        fig = make_subplots(rows=2, cols=2, vertical_spacing=0.15,
+                            specs=[[{}, {}], [{'colspan': 2}, None]],
+                            subplot_titles=['CPU Efficiency', 'Memory Efficiency', 'Most Wasted Core-hours'])
+
+        # The distribution of each account's job efficiencies, with every percentile
+        # of every account calculated in one pass
+        for col, column in enumerate(['cpu_efficiency', 'mem_efficiency'], start=1):
+            percentiles_df = misc.percentiles(accounts_df.dropna(subset=[column]), 'account', column)
+            for account, account_df in percentiles_df.groupby('account'):
+                fig.add_trace(go.Scatter(x=account_df['percentile'], y=account_df[column], name=account,
+                                         legendgroup=account, showlegend=col == 1,
+                                         hovertemplate=account + '<br>Percentile: %{x}<br>Efficiency: %{y}%'),
+                              row=1, col=col)
+            fig.update_xaxes(title_text='Percentile', dtick='10', row=1, col=col)
+            fig.update_yaxes(title_text='Efficiency (%)', row=1, col=col)
+
+        # The users who left the most of the cores they held idle
+        users_df = jobs_df.groupby(['user', 'account'])[['core_hours', 'wasted_hours']].sum().reset_index()
+        users_df = users_df.nlargest(20, 'wasted_hours')
+        users_df['cpu_efficiency'] = 100 * (1 - users_df['wasted_hours'] / users_df['core_hours'])
+        fig.add_trace(go.Bar(x=users_df['user'], y=users_df['wasted_hours'].round(1), showlegend=False,
+                             customdata=users_df[['account', 'cpu_efficiency']].round(1),
+                             hovertemplate='User: %{x}<br>Account: %{customdata[0]}<br>Wasted: %{y} core-hours'
+                                           '<br>CPU efficiency: %{customdata[1]}%<extra></extra>'),
+                      row=2, col=1)
+        fig.update_yaxes(title_text='Core-hours', row=2, col=1)
+
+        fig.update_layout(title_text='Job Efficiency per Account', height=cfg.graph_height, width=cfg.graph_width)
+
+        return fig
+
+
+def start(frames=None, **scope):
+    return Efficiency(scope=scope).run(frames)
+
+
+if __name__ == '__main__':
+    start()
@@ -1,97 +1,50 @@
-import pandas as pd
-from config import db
 from config import cfg
-import mariadb
 import plotly.express as px
-import os
-import pathlib
-import pickle
-from reports import log
-from random import choice
-from string import ascii_lowercase, digits
+from reports import misc, report
 
-def start():
-    # Toggle use of the database
-    use_db_server = db.use_db_server
 
-    # Determine the root of the project location
-    script_path = os.path.realpath(__file__)
-    project_path, report_path = script_path.split(cfg.project_code)
-    log.logger.info('Starting {} - using DB {}'.format(report_path, use_db_server))
+class Gpu(report.Report):
+    # The daily rollups of the jobs on the GPU partitions which didn't request a GPU
+    tables = {'rollup': ['day', 'partition', 'user', 'gpu', 'jobs']}
+    filters = {'rollup': "partition.str.endswith('gpu') and not gpu"}
 
-    # Determine the name and location of the scratch file
-    report_path = pathlib.Path(report_path)
-    script_name = pathlib.Path(report_path.name)
-    report_path = str(report_path.parent).lstrip(os.path.sep)
-    report_name = script_name.stem
-    scratch_name = '.'.join([report_name, 'pkl'])
-    scratch_prefix = '_'.join([report_path, scratch_name])
-    scratch_prefix = scratch_prefix.replace(os.path.sep, '_')
-    scratch_path = os.path.join(project_path, 'scratch', scratch_prefix)
-    output_path = os.path.join(project_path, 'output', report_path)
+    def build(self, frames):
+        jobs_df = frames['rollup']
 
-    # If we're using the database, connect using the credentials from the config file
-    if use_db_server:
-        conn = mariadb.connect(host=db.hostname,
-                               port=db.port,
-                               database=db.database,
-                               user=db.username,
-                               password=db.password)
+        # Count the number of jobs for each user per date
+        jobs_df['date'] = misc.to_datetime(jobs_df['day'])
+        jobs_df = jobs_df.groupby(['date', 'user'], observed=True, dropna=False)['jobs'].sum().reset_index(name='count')
 
-        # Query the number of job submissions for each institute per date
-        # Ensure the end date is older than the start date (i.e. it's completed)
-        query = """SELECT
-        t2.user,
-        DATE_FORMAT(FROM_UNIXTIME(t1.time_end), '%Y-%m-%d') AS date,
-        COUNT(t1.id_job) AS count
-        FROM devcluster_job_table AS t1 LEFT JOIN devcluster_assoc_table AS t2 ON t1.id_assoc=t2.id_assoc
-        WHERE t1.partition LIKE '%gpu'
-        AND t1.tres_req NOT LIKE '%1001%'
-        GROUP BY date, t2.user"""
+        # Replace any NA for 0
+        jobs_df = misc.fillna(jobs_df)
+        # Plotly groups by the colour column, so give it plain labels rather than categories
+        jobs_df['user'] = jobs_df['user'].astype(str)
 
-        jobs_df = pd.read_sql(sql=query, con=conn)
+        # Determine the start and end datetime for the plot
+        start_date = min(jobs_df.date)
+        start_date = start_date.strftime('%d/%m/%Y')
+        end_date = max(jobs_df.date)
+        end_date = end_date.strftime('%d/%m/%Y')
 
-        # Store the date in our scratch in case we want it later
-        scratch_handle = open(scratch_path, 'wb')
-        pickle.dump(jobs_df, scratch_handle)
-        scratch_handle.close()
-    else:
-        # If we're not using the database load the scratch file
-        jobs_df = pd.read_pickle(scratch_path)
+        # Create a line chart based on each institute's wait time
+        fig = px.bar(jobs_df, x='date', y='count', color='user',
+                     hover_data={'user': True, 'count': True, 'date': True},
+                     labels={'user': 'User', 'date': 'Date', 'count': 'Count'},
+                     height=cfg.graph_height, width=cfg.graph_width,
+                     title=f'GPU Partition Misuse<br><sup>{start_date} to {end_date}</sup>')
 
-    jobs_df['date'] = pd.to_datetime(jobs_df['date'], format='%Y-%m-%d')
-    # Replace any NA for 0
-    jobs_df.fillna(value=0, inplace=True)
+        # Update the axes to make them look better
+        fig.update_xaxes(range=[start_date, end_date], type='date', tick0=start_date, tickangle=75,
+                         dtick='172800000', tickformat='%d %b')
+        fig.update_yaxes(tickformat='none')
+        fig.update_layout(xaxis_title='Date', yaxis_title='GPU Misuse')
 
-    # Determine the start and end datetime for the plot
-    start_date = min(jobs_df.date)
-    start_date = start_date.strftime('%d/%m/%Y')
-    end_date = max(jobs_df.date)
-    end_date = end_date.strftime('%d/%m/%Y')
+        return fig
 
-    min_count = 0
-    max_count = max(jobs_df.groupby('date')['count'].sum()) * 1.1
 
-    # Create a line chart based on each institute's wait time
-    fig = px.bar(jobs_df, x='date', y='count', color='user',
-                 hover_data={'user': True, 'count': True, 'date': True},
-                 labels={'user': 'User', 'date': 'Date', 'count': 'Count'},
-                 height=cfg.graph_height, width=cfg.graph_width,
-                 title=f'GPU Partition Misuse<br><sup>{start_date} to {end_date}</sup>')
+def start(frames=None, **scope):
+    return Gpu(scope=scope).run(frames)
 
-    # Update the axes to make them look better
-    fig.update_xaxes(range=[start_date, end_date], type='date', tick0=start_date, tickangle=75,
-                     dtick='172800000', tickformat='%d %b')
-    fig.update_yaxes(tickformat='none')
-    fig.update_layout(xaxis_title='Date', yaxis_title='GPU Misuse')
-
-    # Save the output
-    output_name = '.'.join([report_name, 'html'])
-    output_file = os.path.join(output_path, output_name)
-    fig.write_html(output_file,
-                   config={'displayModeBar': True,
-                           'displaylogo': False,
-                           'modeBarButtonsToRemove': ['lasso2d']})
 
 if __name__ == '__main__':
     start()
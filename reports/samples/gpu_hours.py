@@ -0,0 +1,47 @@
+from config import cfg
+import plotly.express as px
+from reports import misc, report
+
+
+class GpuHours(report.Report):
+    # The daily GPU-hours used by each user, from the TRES allocated to their jobs
+    tables = {'usage': ['day', 'partition', 'account', 'user', 'gpu_hours']}
+    filters = {'usage': 'gpu_hours > 0'}
+
+    def build(self, frames):
+        usage_df = frames['usage']
+
+        # Total the GPU-hours for each account and user per date
+        usage_df['date'] = misc.to_datetime(usage_df['day'])
+        usage_df = usage_df.groupby(['date', 'account', 'user'], observed=True)['gpu_hours'].sum().reset_index()
+        # Plotly groups by the colour column, so give it plain labels rather than categories
+        usage_df = usage_df.astype({'account': str, 'user': str})
+        usage_df['gpu_hours'] = usage_df['gpu_hours'].round(1)
+
+        # Determine the start and end datetime for the plot
+        start_date = min(usage_df.date)
+        start_date = start_date.strftime('%d/%m/%Y')
+        end_date = max(usage_df.date)
+        end_date = end_date.strftime('%d/%m/%Y')
+
+        # Create a stacked bar chart of each account's GPU-hours
+        fig = px.bar(usage_df, x='date', y='gpu_hours', color='account',
+                     hover_data={'account': True, 'user': True, 'gpu_hours': True, 'date': True},
+                     labels={'account': 'Account', 'user': 'User', 'date': 'Date', 'gpu_hours': 'GPU-hours'},
+                     height=cfg.graph_height, width=cfg.graph_width,
+                     title=f'GPU-hours per Account<br><sup>{start_date} to {end_date}</sup>')
+
+        # Update the axes to make them look better
+        fig.update_xaxes(range=[start_date, end_date], type='date', tick0=start_date, tickangle=75,
+                         dtick='172800000', tickformat='%d %b')
+        fig.update_layout(xaxis_title='Date', yaxis_title='GPU-hours')
+
+        return fig
+
+
+def start(frames=None, **scope):
+    return GpuHours(scope=scope).run(frames)
+
+
+if __name__ == '__main__':
+    start()
@@ -0,0 +1,74 @@
+from config import cfg
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from reports import misc, availability, report
+
+
+class NodeAvailability(report.Report):
+    # The node events, including those still open, and the partitions of each node
+    tables = {'event': ['cluster', 'node_name', 'reason', 'time_start', 'time_end'],
+              'open_event': ['cluster', 'node_name', 'reason', 'time_start', 'time_fetched'],
+              'node': ['cluster', 'node_name', 'partitions']}
+    filters = {'event': "time_start < time_end and time_start != 0 and node_name != ''",
+               'open_event': "time_start != 0 and node_name != ''"}
+
+    def build(self, frames):
+        # The nodes still down count until the last sync, so the current month isn't
+        # shown as fully available while they're down
+        events_df = availability.with_open(frames['event'], frames['open_event'])
+
+        # Summarise each calendar month, so only the months with new events are
+        # calculated again and the totals of the months add up exactly
+        windows = availability.months(*self.span(events_df['time_start'].min(), events_df['time_end'].max()))
+        partitions, reasons = [], []
+        for since, until in windows:
+            results = availability.window(events_df, frames['node'], since, until, self.cluster, self.scope)
+            partitions.append(results['partition'].assign(time=since))
+            reasons.append(results['reason'])
+        partition_df = pd.concat(partitions, ignore_index=True)
+        partition_df['date'] = misc.to_datetime(partition_df['time'])
+        reason_df = pd.concat(reasons).groupby('reason')['downtime'].sum().nlargest(10).iloc[::-1]
+
+        # Partitions are only unique within a cluster
+        if partition_df['cluster'].nunique() > 1:
+            partition_df['partition'] = partition_df['cluster'] + ':' + partition_df['partition']
+
+        # Determine the start and end datetime for the plot
+        start_date = misc.to_datetime(pd.Series([windows[0][0]]))[0].strftime('%d/%m/%Y')
+        end_date = misc.to_datetime(pd.Series([windows[-1][1]]))[0].strftime('%d/%m/%Y')
+
+        # The monthly availability of each partition above the reasons which cost the
+        # most node-hours
+        fig = make_subplots(rows=2, cols=1, vertical_spacing=0.12, row_heights=[0.6, 0.4])
+        for partition, month_df in partition_df.groupby('partition'):
+            text = ('Nodes: ' + month_df['nodes'].astype(str)
+                    + '<br>Down: ' + month_df['downtime'].round(1).astype(str) + ' node-hours'
+                    + '<br>Failures: ' + month_df['failures'].astype(str)
+                    + '<br>MTBF: ' + month_df['mtbf'].round(1).astype(str) + ' hours'
+                    + '<br>MTTR: ' + month_df['mttr'].round(1).astype(str) + ' hours')
+            fig.add_trace(go.Scatter(x=month_df['date'], y=month_df['availability'].round(2), name=partition,
+                                     text=text, mode='lines+markers',
+                                     hovertemplate='%{y}%<br>%{text}'), 1, 1)
+        fig.add_trace(go.Bar(x=reason_df.round(1), y=reason_df.index, orientation='h', showlegend=False,
+                             hovertemplate='%{y}: %{x} node-hours<extra></extra>'), 2, 1)
+
+        fig.update_xaxes(row=1, col=1, title_text='Month', type='date', tickformat='%b %Y')
+        fig.update_yaxes(row=1, col=1, title_text='Availability (%)')
+        fig.update_xaxes(row=2, col=1, title_text='Node-hours Down')
+        fig.update_layout(title={'text': f'Node Availability<br><sup>{start_date} to {end_date}</sup>',
+                                 'y': 0.97,
+                                 'x': 0.5,
+                                 'xanchor': 'center',
+                                 'yanchor': 'top'},
+                          height=cfg.graph_height, width=cfg.graph_width)
+
+        return fig
+
+
+def start(frames=None, **scope):
+    return NodeAvailability(scope=scope).run(frames)
+
+
+if __name__ == '__main__':
+    start()
@@ -0,0 +1,71 @@
+from config import cfg
+import numpy as np
+import plotly.graph_objects as go
+from reports import misc, nodes, tres, report
+
+
+class NodeUsage(report.Report):
+    # The jobs which ran with the nodes and cores allocated to them, and the hardware
+    # of each node from the inventory
+    tables = {'job': ['cluster', 'partition', 'nodelist', 'time_start', 'time_end', 'tres_alloc'],
+              'node': ['cluster', 'node_name', 'cpus', 'memory', 'gres']}
+    filters = {'job': "time_start < time_end and time_start != 0 and partition != ''"}
+
+    def build(self, frames):
+        key = ['cluster', 'node_name']
+        jobs_df = frames['job'].astype({'cluster': str})
+        nodes_df = frames['node'].astype({'cluster': str, 'node_name': str, 'gres': str})
+        since, until = self.span(jobs_df['time_start'].min(), jobs_df['time_end'].max())
+
+        # Spread the cores of each job evenly over its nodes, counting the time within the chart
+        tres_df = tres.parse(jobs_df['tres_alloc'], ['cpus', 'nodes'])
+        jobs_df = jobs_df.assign(cpus=tres_df['cpus'].to_numpy() / np.maximum(tres_df['nodes'].to_numpy(), 1),
+                                 hours=(jobs_df['time_end'].clip(upper=until)
+                                        - jobs_df['time_start'].clip(lower=since)).clip(lower=0) / 3600)
+
+        # One row per job and node it ran on, totalled for each node of the inventory
+        used_df = nodes.job_nodes(jobs_df[['cluster', 'nodelist', 'cpus', 'hours']])
+        used_df['core_hours'] = used_df['cpus'] * used_df['hours']
+        used_df = used_df.groupby(key)['core_hours'].sum().reset_index()
+        nodes_df = nodes_df.merge(used_df, on=key, how='left').fillna({'core_hours': 0})
+
+        # Group the nodes by their hardware, within each cluster
+        nodes_df['type'] = (nodes_df['cpus'].astype(str) + ' CPUs, ' + (nodes_df['memory'] // 1024).astype(str)
+                            + ' GB' + np.where(nodes_df['gres'] != '', ', ' + nodes_df['gres'], ''))
+        if nodes_df['cluster'].nunique() > 1:
+            nodes_df['type'] = nodes_df['cluster'] + ': ' + nodes_df['type']
+        types_df = nodes_df.groupby('type').agg(nodes=('node_name', 'size'),
+                                                cores=('cpus', 'sum'),
+                                                core_hours=('core_hours', 'sum'),
+                                                names=('node_name', nodes.compress)).reset_index()
+        types_df['occupancy'] = (100 * types_df['core_hours'] / (types_df['cores'] * (until - since) / 3600)).round(1)
+        types_df['core_hours'] = types_df['core_hours'].round()
+        types_df = types_df.sort_values('occupancy', ascending=False)
+
+        # Determine the start and end datetime for the plot
+        start_date = misc.to_datetime(jobs_df['time_start'].clip(lower=since)).min().strftime('%d/%m/%Y')
+        end_date = misc.to_datetime(jobs_df['time_end'].clip(upper=until)).max().strftime('%d/%m/%Y')
+
+        # The hostlist of the nodes of each type is shown when hovering over it
+        fig = go.Figure(go.Bar(x=types_df['type'], y=types_df['occupancy'],
+                               customdata=types_df[['nodes', 'names', 'core_hours']],
+                               hovertemplate='%{x}<br>Cores in use: %{y}%<br>Core-hours: %{customdata[2]}'
+                                             '<br>Nodes: %{customdata[0]} (%{customdata[1]})<extra></extra>'))
+        fig.update_xaxes(title_text='Node Type')
+        fig.update_yaxes(title_text='Cores in Use (%)')
+        fig.update_layout(title={'text': f'Occupancy per Node Type<br><sup>{start_date} to {end_date}</sup>',
+                                 'y': 0.97,
+                                 'x': 0.5,
+                                 'xanchor': 'center',
+                                 'yanchor': 'top'},
+                          height=cfg.graph_height, width=cfg.graph_width)
+
+        return fig
+
+
+def start(frames=None, **scope):
+    return NodeUsage(scope=scope).run(frames)
+
+
+if __name__ == '__main__':
+    start()
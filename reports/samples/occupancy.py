@@ -0,0 +1,61 @@
+from config import cfg
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from reports import misc, tres, occupancy, report
+
+
+class Occupancy(report.Report):
+    # The jobs which ran, and those still running, with the resources allocated to them
+    tables = {'job': ['partition', 'time_start', 'time_end', 'tres_alloc'],
+              'queue': ['partition', 'time_start', 'time_fetched', 'tres_alloc']}
+    filters = {'job': "time_start < time_end and time_start != 0 and partition != ''",
+               'queue': "time_start != 0 and partition != ''"}
+
+    def build(self, frames):
+        jobs_df = occupancy.with_queue(frames['job'], frames['queue'])
+        jobs_df = jobs_df.join(tres.parse(jobs_df['tres_alloc'], ['cpus', 'gpus']))
+
+        # Use the smallest bucket which doesn't need more points than the plot is wide
+        since, until = self.span(jobs_df['time_start'].min(), jobs_df['time_end'].max())
+        freq = occupancy.frequency(since, until)
+
+        steps_df = occupancy.steps(jobs_df, ['partition'], ['cpus', 'gpus'])
+        busy_df = occupancy.resample(steps_df, ['partition'], ['cpus', 'gpus'], freq, since, until)
+        busy_df['date'] = misc.to_datetime(busy_df['time'])
+
+        # Determine the start and end datetime for the plot
+        start_date = min(busy_df.date)
+        start_date = start_date.strftime('%d/%m/%Y')
+        end_date = max(busy_df.date)
+        end_date = end_date.strftime('%d/%m/%Y')
+
+        # Stack the partitions, with the GPUs below the cores
+        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.05, row_heights=[0.65, 0.35])
+        for partition, partition_df in busy_df.groupby('partition', observed=True):
+            fig.add_trace(go.Scatter(x=partition_df['date'], y=partition_df['cpus'].round(1), name=str(partition),
+                                     legendgroup=str(partition), stackgroup='cpus', mode='lines', line_width=0), 1, 1)
+            if partition_df['gpus'].any():
+                fig.add_trace(go.Scatter(x=partition_df['date'], y=partition_df['gpus'].round(2), name=str(partition),
+                                         legendgroup=str(partition), stackgroup='gpus', mode='lines', line_width=0,
+                                         showlegend=False), 2, 1)
+
+        fig.update_yaxes(row=1, col=1, title_text='Cores in Use')
+        fig.update_yaxes(row=2, col=1, title_text='GPUs in Use')
+        fig.update_xaxes(row=2, col=1, title_text='Date')
+        fig.update_layout(title={'text': f'Cluster Occupancy<br><sup>{start_date} to {end_date}</sup>',
+                                 'y': 0.97,
+                                 'x': 0.5,
+                                 'xanchor': 'center',
+                                 'yanchor': 'top'},
+                          hovermode='x unified',
+                          height=cfg.graph_height, width=cfg.graph_width)
+
+        return fig
+
+
+def start(frames=None, **scope):
+    return Occupancy(scope=scope).run(frames)
+
+
+if __name__ == '__main__':
+    start()
@@ -1,96 +1,50 @@
-import pandas as pd
-from config import db
 from config import cfg
-import mariadb
-import plotly.express as px
-import os
-import pathlib
-import pickle
-from reports import log
-from random import choice
-from string import ascii_lowercase, digits
+import plotly.graph_objects as go
+from reports import misc, drilldown, output, report
 
-def start():
-    # Toggle use of the database
-    use_db_server = db.use_db_server
 
-    # Determine the root of the project location
-    script_path = os.path.realpath(__file__)
-    project_path, report_path = script_path.split(cfg.project_code)
-    log.logger.info('Starting {} - using DB {}'.format(report_path, use_db_server))
+class SuccessVsFailure(report.Report):
+    # The daily rollups of the jobs which completed or failed
+    tables = {'rollup': ['day', 'account', 'user', 'state', 'jobs']}
+    filters = {'rollup': 'state in [3, 5]'}
 
-    # Determine the name and location of the scratch file
-    report_path = pathlib.Path(report_path)
-    script_name = pathlib.Path(report_path.name)
-    report_path = str(report_path.parent).lstrip(os.path.sep)
-    report_name = script_name.stem
-    scratch_name = '.'.join([report_name, 'pkl'])
-    scratch_prefix = '_'.join([report_path, scratch_name])
-    scratch_prefix = scratch_prefix.replace(os.path.sep, '_')
-    scratch_path = os.path.join(project_path, 'scratch', scratch_prefix)
-    output_path = os.path.join(project_path, 'output', report_path)
+    def build(self, frames):
+        jobs_df = frames['rollup']
 
-    # If we're using the database, connect using the credentials from the config file
-    if use_db_server:
-        conn = mariadb.connect(host=db.hostname,
-                               port=db.port,
-                               database=db.database,
-                               user=db.username,
-                               password=db.password)
+        # Determine the start and end datetime for the plot
+        start_date = misc.to_datetime(jobs_df['day'].agg(['min', 'max']))
+        end_date = start_date.iloc[1].strftime('%d/%m/%Y')
+        start_date = start_date.iloc[0].strftime('%d/%m/%Y')
 
-        # Query the number of job submissions for each institute per date
-        # Ensure the end date is older than the start date (i.e. it's completed)
-        query = """SELECT
-        DATE_FORMAT(FROM_UNIXTIME(t1.time_end), '%Y-%m-%d') AS date,
-        t1.state,
-        COUNT(t1.state) AS jobcount,
-        t1.account,
-        t2.user
-        FROM devcluster_job_table AS t1
-        LEFT JOIN devcluster_assoc_table as t2 on t1.id_assoc=t2.id_assoc
-        WHERE t1.time_start < t1.time_end
-        AND t1.time_start <> 0
-        AND t1.partition <> ''
-        GROUP BY date, t2.user, t1.state"""
+        # The chart ignores the date, so count the number of jobs for each user and
+        # state over the whole range
+        jobs_df = jobs_df.groupby(['account', 'state', 'user'],
+                                  observed=True, dropna=False)['jobs'].sum().reset_index(name='jobcount')
 
-        jobs_df = pd.read_sql(sql=query, con=conn)
+        # Replace any NA for 0
+        jobs_df = misc.fillna(jobs_df)
+        jobs_df = jobs_df.astype({'account': str, 'user': str})
+        jobs_df['state'] = jobs_df['state'].replace({3: 'success', 5: 'failure'})
 
-        # Store the date in our scratch in case we want it later
-        scratch_handle = open(scratch_path, 'wb')
-        pickle.dump(jobs_df, scratch_handle)
-        scratch_handle.close()
-    else:
-        # If we're not using the database load the scratch file
-        jobs_df = pd.read_pickle(scratch_path)
+        # Only draw the users with the most jobs in each account, and have the page
+        # load the rest when an account's other segment is clicked
+        path = ['account', 'state', 'user']
+        self.detail = jobs_df[path + ['jobcount']]
+        self.script = drilldown.expand_script(output.detail_name(self.name))
+        jobs_df = drilldown.top(jobs_df, path, 'jobcount', cfg.sunburst_leaves)
 
-    jobs_df['date'] = pd.to_datetime(jobs_df['date'], format='%Y-%m-%d')
-    # Replace any NA for 0
-    jobs_df.fillna(value=0, inplace=True)
-    jobs_df = jobs_df[jobs_df['state'].isin([3, 5])]
-    jobs_df['state'] = jobs_df['state'].replace({3: 'success', 5: 'failure'})
+        # Create a sunburst of each institute's job count
+        fig = go.Figure(drilldown.sunburst(jobs_df, path, 'jobcount'))
+        fig.update_layout(height=cfg.graph_height, width=cfg.graph_width,
+                          title=f'Job Success vs Failures per User<br><sup>{start_date} to {end_date}</sup>')
 
-    institutes = sorted(jobs_df['account'].unique())
+        fig.update_traces(hovertemplate='Label: %{id}<br>Jobs: %{value}<extra></extra>')
 
-    # Determine the start and end datetime for the plot
-    start_date = min(jobs_df.date)
-    start_date = start_date.strftime('%d/%m/%Y')
-    end_date = max(jobs_df.date)
-    end_date = end_date.strftime('%d/%m/%Y')
+        return fig
 
-    # Create a stacked bar chart based on each institute's job count
-    fig = px.sunburst(jobs_df, path=['account', 'state', 'user'], values='jobcount',
-                      height=cfg.graph_height, width=cfg.graph_width,
-                      title=f'Job Success vs Failures per User<br><sup>{start_date} to {end_date}</sup>')
 
-    fig.update_traces(hovertemplate='Label: %{id}<br>Jobs: %{value}')
-
-    # Save the output
-    output_name = '.'.join([report_name, 'html'])
-    output_file = os.path.join(output_path, output_name)
-    fig.write_html(output_file,
-                   config={'displayModeBar': True,
-                           'displaylogo': False,
-                           'modeBarButtonsToRemove': ['lasso2d']})
+def start(frames=None, **scope):
+    return SuccessVsFailure(scope=scope).run(frames)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,47 @@
+from config import cfg
+from plotly.subplots import make_subplots
+import plotly.graph_objects as go
+from reports import misc, rollup, report
+
+
+class Trends(report.Report):
+    # The daily sketches of the elapsed and wait times of the jobs in each partition
+    tables = {'rollup_sketch': ['day', 'partition', 'state', 'metric', 'bucket', 'count']}
+
+    def build(self, frames):
+        sketch_df = frames['rollup_sketch']
+
+        # Only count the elapsed times of the completed jobs, as in the elapsed report
+        sketch_df = sketch_df[(sketch_df['metric'] != 'elapsed') | (sketch_df['state'] == 3)]
+        sketch_df = sketch_df.assign(month=misc.to_datetime(sketch_df['day']).dt.to_period('M').dt.start_time,
+                                     partition=sketch_df['partition'].astype(str))
+
+        fig = make_subplots(rows=2, cols=1, vertical_spacing=0.12,
+                            subplot_titles=['Elapsed Time of Completed Jobs', 'Wait Time'])
+
+        # Merge the daily sketches into the median and 95th percentile of each month
+        for row, metric in enumerate(rollup.metrics, start=1):
+            quantiles_df = rollup.quantiles(sketch_df, ['partition', 'month'], metric, [50, 95])
+            for (partition, point), line_df in quantiles_df.groupby(['partition', 'percentile']):
+                fig.add_trace(go.Scatter(x=line_df['month'], y=(line_df[metric] / 3600).round(2),
+                                         name=partition, legendgroup=partition,
+                                         showlegend=bool(row == 1 and point == 50),
+                                         line={'dash': 'solid' if point == 50 else 'dash'},
+                                         hovertemplate=partition + '<br>Month: %{x|%b %Y}<br>'
+                                                       + '{}th percentile: '.format(point) + '%{y} hours'),
+                              row=row, col=1)
+            fig.update_yaxes(title_text='Hours (median, dashed 95th percentile)', row=row, col=1)
+
+        fig.update_xaxes(title_text='Month', dtick='M1', tickformat='%b %Y')
+        fig.update_layout(title_text='Elapsed and Wait Times per Month', height=cfg.graph_height,
+                          width=cfg.graph_width)
+
+        return fig
+
+
+def start(frames=None, **scope):
+    return Trends(scope=scope).run(frames)
+
+
+if __name__ == '__main__':
+    start()
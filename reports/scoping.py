@@ -0,0 +1,113 @@
+
+
+# A scope narrows the rows a report reads, given as a dict with any of these keys:
+# since and until as epochs, and lists of partitions, accounts and users. Jobs and
+# events are in range when they overlap [since, until), which the cache can prune
+# on time_end, and the daily and per job tables when their day or end is in it.
+# The filters are pushed down to the cached files, and to the WHERE clause of the
+# queries which aggregate on the database server.
+parameters = ['since', 'until', 'partition', 'account', 'user']
+intervals = ['job', 'queue', 'event', 'open_event']
+
+# The column of each table each filter applies to. Jobs are matched to users by
+# their association, and nodes to partitions by the node inventory.
+columns = {'partition': {'job': 'partition', 'queue': 'partition', 'rollup': 'partition',
+                         'rollup_sketch': 'partition', 'usage': 'partition', 'efficiency': 'partition',
+                         'event': 'node_name', 'open_event': 'node_name', 'node': 'node_name'},
+           'account': {'job': 'account', 'queue': 'account', 'rollup': 'account', 'usage': 'account',
+                       'efficiency': 'account'},
+           'user': {'job': 'id_assoc', 'queue': 'id_assoc', 'rollup': 'user', 'usage': 'user', 'efficiency': 'user'}}
+
+# The node inventory describes the nodes the jobs ran on rather than who ran them,
+# so it's read whole for a scope of accounts or users, e.g. for the cores of a node
+whole = {'node': ['account', 'user']}
+
+
+# The filters of a scope which the tables have no column for, as (table, filter)
+# pairs. A report which reads any of them isn't run for the scope, rather than being
+# written under the label of the scope without being narrowed to it.
+def unsupported(tables, scope):
+    scope = scope or {}
+    return [(table, name) for table in tables for name in ['partition', 'account', 'user']
+            if scope.get(name) and table not in columns[name] and name not in whole.get(table, [])]
+
+
+# The range of the time column of a table to read the files and rows of
+def bounds(table, scope):
+    scope = scope or {}
+    if table in intervals:
+        return scope.get('since'), None
+
+    return scope.get('since'), scope.get('until')
+
+
+# The values of a column matching a filter for each cluster, or None for every
+# cluster, where the values are looked up in another table
+def values(table, name, wanted):
+    # Only imported to read the scope, so the command line can check scopes cheaply
+    from reports import cache
+
+    if name == 'user' and table in ['job', 'queue']:
+        assoc_df = cache.read('assoc', columns=['cluster', 'id_assoc', 'user'])
+        matched_df = assoc_df[assoc_df['user'].isin(wanted)]
+        return matched_df.groupby('cluster', observed=True)['id_assoc'].agg(list).to_dict()
+    if name == 'partition' and table in ['event', 'open_event', 'node']:
+        nodes_df = cache.read('node', columns=['cluster', 'node_name', 'partitions'])
+        matched = nodes_df['partitions'].str.split(',').apply(lambda partitions: not set(partitions).isdisjoint(wanted))
+        return nodes_df[matched].groupby('cluster', observed=True)['node_name'].agg(list).to_dict()
+
+    return {None: list(wanted)}
+
+
+# The row filters of a table as Parquet filters in disjunctive normal form, i.e. a
+# list of lists of (column, op, value) where the rows match any list. None reads
+# every row, and an empty list none, e.g. when a user isn't in any cluster.
+def predicates(table, scope):
+    scope = scope or {}
+    conjunctions = [[]]
+    if table in intervals and scope.get('until') is not None:
+        conjunctions[0].append(('time_start', '<', scope['until']))
+
+    for name in ['partition', 'account', 'user']:
+        wanted = scope.get(name)
+        if not wanted:
+            continue
+        if name in whole.get(table, []):
+            continue
+        if table not in columns[name]:
+            raise ValueError('The {} table has no {} to filter on'.format(table, name))
+
+        column = columns[name][table]
+        matches = [[('cluster', '==', cluster)] * (cluster is not None) + [(column, 'in', matched)]
+                   for cluster, matched in values(table, name, wanted).items()]
+        conjunctions = [conjunction + match for conjunction in conjunctions for match in matches]
+
+    if len(conjunctions) == 1 and len(conjunctions[0]) == 0:
+        return None
+
+    return conjunctions
+
+
+# Quote a value for SQL
+def quote(value):
+    return "'{}'".format(str(value).replace('\\', '\\\\').replace("'", "''"))
+
+
+# The conditions on the job table for the WHERE clause of a query, each starting
+# with AND, for the queries which aggregate on the database server. Users are
+# matched through the association table given.
+def where(scope, assoc_table):
+    scope = scope or {}
+    conditions = []
+    if scope.get('since') is not None:
+        conditions.append('t1.time_end >= {:d}'.format(int(scope['since'])))
+    if scope.get('until') is not None:
+        conditions.append('t1.time_start < {:d}'.format(int(scope['until'])))
+    for name, column in [('partition', 'partition'), ('account', 'account')]:
+        if scope.get(name):
+            conditions.append('t1.{} IN ({})'.format(column, ', '.join(quote(value) for value in scope[name])))
+    if scope.get('user'):
+        conditions.append('t1.id_assoc IN (SELECT id_assoc FROM {} WHERE user IN ({}))'
+                          .format(assoc_table, ', '.join(quote(value) for value in scope['user'])))
+
+    return ''.join('\n            AND {}'.format(condition) for condition in conditions)
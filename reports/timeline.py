@@ -0,0 +1,61 @@
+import numpy as np
+import plotly.graph_objects as go
+from config import cfg
+from reports import misc, instrument
+
+
+# Merge the overlapping or adjacent intervals of each group with a single sort and
+# sweep. Intervals which start within gap seconds of the end of the last one are
+# also merged, and the number of intervals merged into each row is kept in events.
+@instrument.timed
+def merge(df, by, start='time_start', end='time_end', gap=0):
+    df = df.sort_values(by + [start], ignore_index=True)
+
+    # A new interval begins with each group, or when it starts after the furthest
+    # end reached so far in its group
+    first = df[by].ne(df[by].shift()).any(axis=1)
+    reach = df.groupby(by, observed=True, sort=False)[end].cummax().shift()
+    block = (first | (df[start] > reach + gap)).cumsum()
+
+    aggregations = {column: (column, 'first') for column in by}
+    aggregations[start] = (start, 'first')
+    aggregations[end] = (end, 'max')
+    if 'events' in df:
+        aggregations['events'] = ('events', 'sum')
+    else:
+        aggregations['events'] = (start, 'size')
+
+    return df.groupby(block).agg(**aggregations).reset_index(drop=True)
+
+
+# Merge the intervals closer together than one pixel across the plot, so the
+# number drawn depends on the plot width rather than the number of events
+def downsample(df, by, start='time_start', end='time_end', width=None):
+    gap = (df[end].max() - df[start].min()) // (width or cfg.graph_width)
+    return merge(df, by, start, end, gap=gap)
+
+
+# Draw the intervals as horizontal bars of a single WebGL line trace, broken
+# between the bars, rather than as one SVG shape per interval
+def figure(df, y, text, start='time_start', end='time_end', **layout):
+    number = len(df)
+    rows = max(df[y].nunique(), 1)
+
+    # Epochs in local time as milliseconds, which Plotly draws on a date axis
+    x = np.full(number * 3, np.nan)
+    x[0::3] = misc.to_datetime(df[start]).astype('int64') // 10 ** 6
+    x[1::3] = misc.to_datetime(df[end]).astype('int64') // 10 ** 6
+
+    labels = np.full(number * 3, None, dtype=object)
+    labels[0::3] = labels[1::3] = df[y].astype(str).to_numpy()
+
+    hover = np.full(number * 3, None, dtype=object)
+    hover[0::3] = hover[1::3] = text.to_numpy()
+
+    height = layout.get('height', cfg.graph_height)
+    fig = go.Figure(go.Scattergl(x=x, y=labels, text=hover, mode='lines', connectgaps=False,
+                                 hovertemplate='%{text}<extra></extra>', showlegend=False,
+                                 line={'width': max(1, min(20, int(height * 0.8 / rows)))}))
+    fig.update_layout(**layout)
+    fig.update_yaxes(type='category', categoryorder='category ascending')
+    return fig
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+# The ids of the trackable resources in the TRES strings of slurmdbd, e.g.
+# 1=8,2=64000,4=1,1001=2 for 8 CPUs, 64000 MB of memory, one node and two GPUs.
+# The GPUs are the first GRES registered, so check tres_table if they differ here.
+ids = {'cpus': 1,
+       'mem': 2,
+       'energy': 3,
+       'nodes': 4,
+       'billing': 5,
+       'gpus': 1001}
+
+
+# Split TRES strings into one integer column per resource, with 0 for the resources
+# a string doesn't list or if it can't be read. The strings are split into alternate
+# ids and counts in Arrow rather than with a Python loop over the rows.
+def parse(strings, resources=('cpus', 'mem', 'nodes', 'gpus')):
+    strings = pd.Series(strings)
+    array = pa.array(strings.astype(object), type=pa.string(), from_pandas=True)
+
+    tokens = pc.split_pattern(pc.replace_substring(array, '=', ','), ',')
+    rows = pc.list_parent_indices(tokens).to_numpy()
+    position = np.arange(len(rows)) - tokens.offsets.to_numpy()[rows]
+    tokens = pc.list_flatten(tokens)
+    # Only ASCII digits which fit in an int64 can be cast, other Unicode digits can't
+    digits = pc.and_(pc.ascii_is_decimal(tokens), pc.less_equal(pc.binary_length(tokens), 18))
+    digits = digits.to_numpy(zero_copy_only=False)
+    numbers = pc.cast(pc.if_else(digits, tokens, '0'), pa.int64()).to_numpy()
+
+    # Skip the strings which aren't all id=count pairs, including empty strings
+    lengths = np.bincount(rows, minlength=len(strings))
+    invalid = np.bincount(rows[~digits], minlength=len(strings))
+    valid = ((lengths % 2 == 0) & (invalid == 0))[rows]
+
+    keys = np.where(valid & (position % 2 == 0), numbers, -1)[:-1]
+    counts = numbers[1:]
+    rows = rows[:-1]
+
+    columns = {}
+    for resource in resources:
+        column = np.zeros(len(strings), dtype=np.int64)
+        selected = keys == ids[resource]
+        column[rows[selected]] = counts[selected]
+        columns[resource] = column
+
+    return pd.DataFrame(columns, index=strings.index)
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+from config import db
+from reports import log, misc, cache, tres
+
+
+# The usage table holds the CPU-, memory- (GB) and GPU-hours of the jobs which ran
+# per day and combination of these columns. A job is split across the days it ran
+# on, so any range of days counts the hours used within it, and end_day is the day
+# the job ended so the table can be updated incrementally.
+dimensions = ['cluster', 'partition', 'account', 'user']
+metrics = ['cpu_hours', 'mem_hours', 'gpu_hours']
+
+
+# The start of the local day after each day start, allowing for clock changes
+def next_day(days):
+    return misc.to_epoch(misc.to_datetime(days + 86400 + 43200).dt.normalize())
+
+
+# Split each job into one row per local day it ran on, with the seconds it ran for
+# in that day
+def split_days(jobs_df):
+    first = misc.to_epoch(misc.to_datetime(jobs_df['time_start']).dt.normalize()).to_numpy()
+    last = misc.to_epoch(misc.to_datetime(jobs_df['time_end'] - 1).dt.normalize()).to_numpy()
+    number = np.rint((last - first) / 86400).astype(int) + 1
+
+    # Step through the days from noon, so clock changes can't move to the wrong day
+    offset = np.arange(number.sum()) - np.repeat(np.cumsum(number) - number, number)
+    day = misc.to_epoch(misc.to_datetime(pd.Series(np.repeat(first, number) + offset * 86400 + 43200))
+                        .dt.normalize()).to_numpy()
+
+    days_df = jobs_df.iloc[np.repeat(np.arange(len(jobs_df)), number)].reset_index(drop=True)
+    seconds = (np.minimum(days_df['time_end'].to_numpy(), next_day(pd.Series(day)).to_numpy())
+               - np.maximum(days_df['time_start'].to_numpy(), day))
+
+    return days_df.assign(day=day, seconds=seconds)
+
+
+# Calculate the usage of the jobs of each cluster which ended on or after the start
+# of the last end day already calculated, so the partial last day and any new days
+# are replaced. As with the rollups, the days from db.lookback before it are
+# calculated again, and a cluster without any usage yet from the start.
+def update():
+    marks = {cluster: None if day is None else misc.day_start(day - db.lookback)
+             for cluster, day in cache.latest('usage', 'end_day', db.clusters).items()}
+
+    jobs_df = cache.read_since('job', marks, columns=['cluster', 'id_assoc', 'account', 'partition', 'time_start',
+                                                      'time_end', 'tres_req', 'tres_alloc'])
+    jobs_df = jobs_df[(jobs_df['time_start'] < jobs_df['time_end'])
+                      & (jobs_df['time_start'] != 0)
+                      & (jobs_df['partition'] != '')]
+    if len(jobs_df) == 0:
+        return 0
+
+    # Count what was allocated, or what was requested for jobs without an allocation
+    tres_df = tres.parse(jobs_df['tres_alloc'])
+    missing = tres_df['cpus'] == 0
+    tres_df.loc[missing] = tres.parse(jobs_df.loc[missing, 'tres_req'])
+
+    jobs_df = cache.lookup(jobs_df, 'assoc', ['cluster', 'id_assoc'], ['user'])
+    jobs_df = jobs_df.assign(end_day=misc.to_epoch(misc.to_datetime(jobs_df['time_end']).dt.normalize()),
+                             cpus=tres_df['cpus'].to_numpy(),
+                             mem=tres_df['mem'].to_numpy() / 1024,
+                             gpus=tres_df['gpus'].to_numpy())
+
+    days_df = split_days(jobs_df[dimensions + ['time_start', 'time_end', 'end_day', 'cpus', 'mem', 'gpus']])
+    hours = days_df['seconds'] / 3600
+    days_df = days_df.assign(cpu_hours=days_df['cpus'] * hours,
+                             mem_hours=days_df['mem'] * hours,
+                             gpu_hours=days_df['gpus'] * hours)
+
+    usage_df = days_df.groupby(['day', 'end_day'] + dimensions, observed=True, dropna=False)[metrics].sum().reset_index()
+    cache.merge('usage', cache.typed(usage_df), ['day', 'end_day'] + dimensions)
+
+    log.logger.info('Calculated the usage of {} jobs over {} days'.format(len(jobs_df), days_df['day'].nunique()))
+    return len(jobs_df)